@@ -33,3 +33,293 @@ networkClient.init();
 export const nodeClient = networkClient.nodeClients[node_number];
 
 export const chat: Chat = new contracts["Chat"](networkClient);
+
+type PooledNode<T> = {
+  client: T;
+  in_flight: number;
+  healthy: boolean;
+  calls: number;
+  failed_checks: number;
+};
+
+/**
+ * spreads calls over several node clients. Each node runs at most
+ * `max_in_flight` calls at once, reads go to the least loaded healthy
+ * node, and writes for a room always go to the same healthy node, one at a
+ * time, so they are applied in the order they were made. The api doesn't
+ * use it yet: the generated Chat client picks the node of each call from
+ * its key alias, so there is no per-node client to pool
+ */
+export class NodePool<T> {
+  nodes: PooledNode<T>[];
+  //calls waiting for a free slot
+  waiting: (() => void)[] = [];
+  //the last write of each room, which the room's next write waits for
+  room_writes: Map<string, Promise<void>> = new Map();
+  private health_timer?: NodeJS.Timeout;
+
+  /**
+   * @param clients - the node clients to spread calls over
+   * @param check_health - resolves if a node is usable, rejects otherwise
+   * @param max_in_flight - the most concurrent calls per node
+   */
+  constructor(
+    clients: T[],
+    private check_health: (client: T) => Promise<any>,
+    private max_in_flight = 16
+  ) {
+    this.nodes = clients.map((client) => ({
+      client,
+      in_flight: 0,
+      healthy: true,
+      calls: 0,
+      failed_checks: 0,
+    }));
+  }
+
+  //every node is down, so try them all rather than failing outright
+  private candidates() {
+    let healthy = this.nodes.filter((node) => node.healthy);
+    return healthy.length ? healthy : this.nodes;
+  }
+
+  //a stable choice per key, that only moves the keys of a node that goes
+  //down (rendezvous hashing)
+  private node_for(key: string) {
+    let candidates = this.candidates();
+    let best: PooledNode<T>;
+    let best_score = -1;
+    for (let [i, node] of this.nodes.entries()) {
+      if (!candidates.includes(node)) {
+        continue;
+      }
+      let score = 0;
+      for (let c of `${i}:${key}`) {
+        score = (score * 31 + c.charCodeAt(0)) >>> 0;
+      }
+      if (score > best_score) {
+        best = node;
+        best_score = score;
+      }
+    }
+    return best;
+  }
+
+  private async run<R>(
+    pick: () => PooledNode<T>,
+    call: (client: T) => Promise<R>
+  ): Promise<R> {
+    if (this.nodes.length === 0) {
+      return Promise.reject(new Error("No nodes to send the call to!"));
+    }
+    let node = pick();
+    while (node.in_flight >= this.max_in_flight) {
+      await new Promise<void>((resolve) => this.waiting.push(resolve));
+      node = pick();
+    }
+    node.in_flight++;
+    node.calls++;
+    try {
+      return await call(node.client);
+    } finally {
+      node.in_flight--;
+      //wake every waiter, they each pick again
+      this.waiting.splice(0).forEach((resolve) => resolve());
+    }
+  }
+
+  /**
+   * runs a read on the least loaded healthy node
+   */
+  read<R>(call: (client: T) => Promise<R>): Promise<R> {
+    return this.run(() => {
+      let nodes = [...this.candidates()];
+      nodes.sort((lhs, rhs) => lhs.in_flight - rhs.in_flight);
+      return nodes[0];
+    }, call);
+  }
+
+  /**
+   * runs a write on the node that handles the writes of `room_channel`,
+   * once the previous write for the room has finished
+   */
+  write<R>(room_channel: string, call: (client: T) => Promise<R>) {
+    let previous = this.room_writes.get(room_channel) || Promise.resolve();
+    let result = previous.then(() =>
+      this.run(() => this.node_for(room_channel), call)
+    );
+    //a failed write doesn't hold up the writes after it
+    let done = result.then(
+      () => {},
+      () => {}
+    );
+    this.room_writes.set(room_channel, done);
+    done.then(() => {
+      if (this.room_writes.get(room_channel) === done) {
+        this.room_writes.delete(room_channel);
+      }
+    });
+    return result;
+  }
+
+  /**
+   * checks every node, marking those that fail unhealthy until they
+   * pass a check again
+   */
+  async check_nodes(): Promise<void> {
+    await Promise.all(
+      this.nodes.map(async (node) => {
+        try {
+          await this.check_health(node.client);
+          node.healthy = true;
+          node.failed_checks = 0;
+        } catch {
+          node.healthy = false;
+          node.failed_checks++;
+        }
+      })
+    );
+    this.waiting.splice(0).forEach((resolve) => resolve());
+  }
+
+  start_health_checks(interval_ms = 5000) {
+    this.health_timer = setInterval(() => this.check_nodes(), interval_ms);
+  }
+
+  stop_health_checks() {
+    clearInterval(this.health_timer);
+  }
+
+  stats() {
+    return this.nodes.map((node, i) => ({
+      node: i,
+      healthy: node.healthy,
+      in_flight: node.in_flight,
+      calls: node.calls,
+      failed_checks: node.failed_checks,
+    }));
+  }
+}
+
+type PendingBatch = {
+  key_alias: string;
+  room_channel: string;
+  messages: string[];
+  waiters: { resolve: () => void; reject: (e: Error) => void }[];
+  timer?: NodeJS.Timeout;
+};
+
+/**
+ * coalesces the messages sent by one key alias to one room within a short
+ * window into a single send_messages transaction, so that bursts of sends
+ * cost one transaction per sender and room rather than one per message
+ */
+export class SendQueue {
+  //batches still collecting messages, by key alias and room
+  pending: Map<string, PendingBatch> = new Map();
+  //the last submitted batch of each key alias and room, so that batches
+  //for the same sender and room are committed in order
+  submitting: Map<string, Promise<void>> = new Map();
+  //messages accepted but not committed yet
+  depth = 0;
+  metrics = {
+    enqueued: 0,
+    rejected: 0,
+    batches: 0,
+    messages_sent: 0,
+    max_depth: 0,
+  };
+
+  /**
+   * @param send_batch - sends the messages of one sender to one room
+   * @param window_ms - how long a batch waits for more messages
+   * @param max_batch - a batch is sent as soon as it has this many messages
+   * @param max_depth - sends are refused while this many are queued
+   */
+  constructor(
+    private send_batch: (
+      key_alias: string,
+      room_channel: string,
+      messages: string[]
+    ) => Promise<any>,
+    private window_ms = 20,
+    private max_batch = 50,
+    private max_depth = 1000
+  ) {}
+
+  /**
+   * queues a message, to be sent together with the sender's other messages
+   * to the same room
+   * @returns a promise that resolves once the message is committed
+   */
+  send(key_alias: string, room_channel: string, message: string) {
+    if (this.depth >= this.max_depth) {
+      this.metrics.rejected++;
+      let error: any = new Error("Too many messages queued, try again later!");
+      error.status = 503;
+      return Promise.reject(error);
+    }
+    let key = `${key_alias}/${room_channel}`;
+    let batch = this.pending.get(key);
+    if (!batch) {
+      batch = { key_alias, room_channel, messages: [], waiters: [] };
+      this.pending.set(key, batch);
+      batch.timer = setTimeout(() => this.submit(key), this.window_ms);
+    }
+    this.depth++;
+    this.metrics.enqueued++;
+    this.metrics.max_depth = Math.max(this.metrics.max_depth, this.depth);
+    batch.messages.push(message);
+    let committed = new Promise<void>((resolve, reject) => {
+      batch.waiters.push({ resolve, reject });
+    });
+    if (batch.messages.length >= this.max_batch) {
+      this.submit(key);
+    }
+    return committed;
+  }
+
+  private submit(key: string) {
+    let batch = this.pending.get(key);
+    if (!batch) {
+      return;
+    }
+    clearTimeout(batch.timer);
+    this.pending.delete(key);
+    let previous = this.submitting.get(key) || Promise.resolve();
+    let submitted = previous.then(async () => {
+      try {
+        await this.send_batch(
+          batch.key_alias,
+          batch.room_channel,
+          batch.messages
+        );
+        this.metrics.batches++;
+        this.metrics.messages_sent += batch.messages.length;
+        batch.waiters.forEach((waiter) => waiter.resolve());
+      } catch (e) {
+        //the batch is one transaction, so every message in it failed
+        batch.waiters.forEach((waiter) => waiter.reject(e));
+      } finally {
+        this.depth -= batch.messages.length;
+        if (this.submitting.get(key) === submitted) {
+          this.submitting.delete(key);
+        }
+      }
+    });
+    this.submitting.set(key, submitted);
+  }
+}
+
+//with `coalesce_sends` on the command line, send_message requests are
+//queued and sent in batches
+export const coalesce_sends = process.argv.includes("coalesce_sends");
+
+export const send_queue = new SendQueue(
+  async (key_alias: string, room_channel: string, messages: string[]) => {
+    if (messages.length === 1) {
+      return chat.sendMessage(key_alias, room_channel, messages[0]);
+    }
+    return chat.sendMessages(key_alias, room_channel, messages);
+  }
+);
@@ -1,8 +1,12 @@
-import { networkClient, nodeClient } from "./assembly-wrapper";
+import { chat, networkClient, nodeClient } from "./assembly-wrapper";
 import Primus, { Spark } from "primus";
 import * as userManager from "./user-manager";
+import { RoomMembership } from "./room-membership";
+import { cacheMessage } from "./message-cache";
+import { decode_message } from "./message-codec";
 
-const sparks = {};
+//the primus spark ids of each connected key alias
+export const sparks = {};
 
 async function send_event_response(primus, member, e) {
   if (sparks[member]) {
@@ -19,20 +23,102 @@ async function send_event_response(primus, member, e) {
   }
 }
 
-export const initialize_events = (primus: Primus) => {
-  nodeClient.on("*", async (e) => {
-    let event_meta = e.type.split("/");
-    if (event_meta[event_meta.length - 1].includes("Event")) {
-      for (let member of e.data.room.members) {
-        send_event_response(primus, member, e);
-      }
-      //if its a RemoveFromRoomEvent, alert the kicked person that
-      //they have been removed
-      if (e.data.removee) {
-        send_event_response(primus, e.data.removee, e);
-      }
+//with `delta_events` on the command line, membership changes are pushed to
+//clients as compact MembershipDeltaEvents instead of events carrying the
+//whole room, so a change costs O(1) data per member
+export const delta_events = process.argv.includes("delta_events");
+
+const full_membership_events = [
+  "InviteToRoomEvent",
+  "RemoveFromRoomEvent",
+  "PromoteToOwnerEvent",
+  "DemoteOwnerEvent",
+];
+
+//rooms are read through a member whose key alias belongs to this api
+export const membership = new RoomMembership(async (room_channel, members) => {
+  let reader = members.find(userManager.is_local_key_alias);
+  if (!reader) {
+    return undefined;
+  }
+  try {
+    return await chat.getRoom(reader, room_channel);
+  } catch {
+    return undefined;
+  }
+});
+
+//with `push_messages` on the command line, a new message is read once by
+//id and pushed to members together with its SendMessageEvent, instead of
+//every member's client asking for it after the event
+export const push_messages = process.argv.includes("push_messages");
+
+//adds the message named by a SendMessageEvent to the event, read through
+//a member connected to this api. If that's not possible the event is
+//left as is, and clients fetch the message themselves
+export const with_message = async (e) => {
+  let room = e.data.room;
+  let reader = room.members.find((member) => sparks[member]);
+  if (!reader) {
+    return e;
+  }
+  try {
+    let message = decode_message(
+      await chat.getMessage(reader, room.channel, e.data.message_id)
+    );
+    cacheMessage(room.channel, message);
+    return { ...e, data: { ...e.data, message: message } };
+  } catch {
+    return e;
+  }
+};
+
+export const handle_event = async (
+  primus: Primus,
+  e,
+  push: boolean = push_messages
+) => {
+  let event_meta = e.type.split("/");
+  let event_name = event_meta[event_meta.length - 1];
+  if (!event_name.includes("Event")) {
+    return;
+  }
+  if (event_name === "MembershipDeltaEvent") {
+    if (!delta_events) {
+      return;
+    }
+    for (let member of await membership.apply_delta(e.data)) {
+      send_event_response(primus, member, e);
+    }
+    //removed members are no longer in the room, but are told they left
+    if (e.data.action === "remove") {
+      send_event_response(primus, e.data.member, e);
     }
-  }); /**/
+    return;
+  }
+  if (delta_events) {
+    //membership is tracked from the deltas, the full membership events are
+    //only for clients that don't ask for deltas
+    if (full_membership_events.includes(event_name)) {
+      return;
+    }
+    membership.apply_snapshot(e.data.room);
+  }
+  if (push && event_name === "SendMessageEvent") {
+    e = await with_message(e);
+  }
+  for (let member of e.data.room.members) {
+    send_event_response(primus, member, e);
+  }
+  //if its a RemoveFromRoomEvent, alert the kicked person that
+  //they have been removed
+  if (e.data.removee) {
+    send_event_response(primus, e.data.removee, e);
+  }
+};
+
+export const initialize_events = (primus: Primus) => {
+  nodeClient.on("*", async (e) => handle_event(primus, e)); /**/
 
   primus.on("connection", async (spark) => {
     spark.on("data", async (msg) => {
@@ -1,17 +1,62 @@
 import { chat } from "./assembly-wrapper";
+import { decode_message } from "./message-codec";
+
+//how many messages to request per page when filling the cache
+const PAGE_SIZE = 500;
 
 //variable to hold the cache for the messages
 export const message_cache = {
   room_id: { message_id: "message" },
 };
 
+//the highest message sequence number cached for each room
+const cached_seq = {};
+
 export const updateCache = async function updateCache(
   ka: string,
   room_channel: string
 ): Promise<void> {
-  message_cache[room_channel] = {};
-  let messages = await chat.getMessages(ka, room_channel);
-  for (let message of messages) {
-    message_cache[room_channel][message.message_id] = message;
+  if (!message_cache[room_channel]) {
+    message_cache[room_channel] = {};
+    cached_seq[room_channel] = 0;
+  }
+  //messages are numbered without gaps, so only the ones after the
+  //last cached sequence number need to be fetched
+  let messages;
+  do {
+    messages = await chat.getMessagesAfter(
+      ka,
+      room_channel,
+      cached_seq[room_channel],
+      PAGE_SIZE
+    );
+    for (let message of messages) {
+      message_cache[room_channel][message.message_id] = decode_message(message);
+      cached_seq[room_channel] = Math.max(
+        cached_seq[room_channel],
+        message.seq
+      );
+    }
+  } while (messages.length === PAGE_SIZE);
+};
+
+/**
+ * caches a single message, e.g. one fetched to be pushed to clients
+ * @param room_channel - the room of the message
+ * @param message - the decoded message
+ */
+export const cacheMessage = function cacheMessage(
+  room_channel: string,
+  message
+): void {
+  //rooms that aren't cached yet are filled from the start by updateCache
+  if (!message_cache[room_channel]) {
+    return;
+  }
+  message_cache[room_channel][message.message_id] = message;
+  //only advance past consecutive messages, so that updateCache still
+  //fetches any that were missed
+  if (message.seq === cached_seq[room_channel] + 1) {
+    cached_seq[room_channel] = message.seq;
   }
 };
@@ -0,0 +1,35 @@
+import { Context } from "koa";
+import * as zlib from "zlib";
+
+//bodies stored with this encoding are zlib-compressed, then base64-encoded
+const ZLIB_BASE64 = "zlib+base64";
+
+/**
+ * decodes the body of a message returned by the contract,
+ * so that callers only ever see plain text
+ * @param message - a message as returned by get_messages
+ * @returns the message, with a plain text body
+ */
+export const decode_message = function decode_message(message: any): any {
+  if (message && message.encoding === ZLIB_BASE64) {
+    return {
+      ...message,
+      body: zlib
+        .inflateSync(Buffer.from(message.body, "base64"))
+        .toString("utf-8"),
+      encoding: "",
+    };
+  }
+  return message;
+};
+
+//decodes the message, or every message in a list, returned by an assembly
+//route. Bodies that aren't messages have no encoding and are left as is
+export const decode_message_bodies = async (ctx: Context, next: any) => {
+  await next();
+  if (Array.isArray(ctx.body)) {
+    ctx.body = ctx.body.map(decode_message);
+  } else if (ctx.body && typeof ctx.body === "object") {
+    ctx.body = decode_message(ctx.body);
+  }
+};
@@ -0,0 +1,80 @@
+//tracks the members of each room from the events seen by this node,
+//so that compact MembershipDeltaEvents can be fanned out without
+//each event carrying the whole room
+
+type RoomSnapshot = { channel: string; version: number; members: string[] };
+type MembershipDelta = {
+  room_channel: string;
+  room_version: number;
+  action: string;
+  actor: string;
+  member: string;
+};
+
+export class RoomMembership {
+  rooms: { [channel: string]: { version: number; members: Set<string> } } =
+    {};
+  snapshots_fetched = 0;
+
+  /**
+   * @param fetch_snapshot - reads the current room through one of the given
+   * key aliases, which are those that may still be members of the room. Used
+   * when a delta arrives for an unknown room or after a version gap
+   */
+  constructor(
+    private fetch_snapshot: (
+      room_channel: string,
+      members: string[]
+    ) => Promise<RoomSnapshot | undefined>
+  ) {}
+
+  /**
+   * records a full room, unless the same or a newer version is already known
+   * @param room - the room as carried by the full room events
+   */
+  apply_snapshot(room: RoomSnapshot) {
+    if (!room || room.version === undefined) {
+      return;
+    }
+    let known = this.rooms[room.channel];
+    if (!known || known.version < room.version) {
+      this.rooms[room.channel] = {
+        version: room.version,
+        members: new Set(room.members),
+      };
+    }
+  }
+
+  /**
+   * applies a membership delta, fetching the whole room if the delta
+   * doesn't directly follow the known version
+   * @param delta - the data of a MembershipDeltaEvent
+   * @returns the members of the room after the change
+   */
+  async apply_delta(delta: MembershipDelta): Promise<string[]> {
+    let known = this.rooms[delta.room_channel];
+    if (known && delta.room_version === known.version + 1) {
+      if (delta.action === "invite") {
+        known.members.add(delta.member);
+      } else if (delta.action === "remove") {
+        known.members.delete(delta.member);
+      }
+      known.version = delta.room_version;
+    } else if (!known || delta.room_version > known.version) {
+      //a gap, fetch the room as it is now. A removed member can't read it
+      this.snapshots_fetched++;
+      let members = new Set(known ? known.members : []);
+      members.add(delta.actor);
+      if (delta.action === "remove") {
+        members.delete(delta.member);
+      } else {
+        members.add(delta.member);
+      }
+      this.apply_snapshot(
+        await this.fetch_snapshot(delta.room_channel, [...members])
+      );
+    }
+    let room = this.rooms[delta.room_channel];
+    return room ? [...room.members] : [];
+  }
+}
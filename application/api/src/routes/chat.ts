@@ -1,5 +1,7 @@
 import Koa, { Context } from "koa";
 import { assembly_router } from "./generated/chat";
+import { decode_message_bodies } from "../message-codec";
+import { coalesce_sends, send_queue } from "../assembly-wrapper";
 const assembly: Koa = new Koa();
 
 export const move_query_to_state = async (ctx: Context, next: any) => {
@@ -23,6 +25,25 @@ export const move_query_to_state = async (ctx: Context, next: any) => {
 
 assembly.use(move_query_to_state);
 
+//send_message requests go through the send queue, which coalesces bursts
+//into send_messages transactions, and answer once the message is committed
+export const queue_send_message = async (ctx: Context, next: any) => {
+  if (!coalesce_sends || ctx.path !== "/send_message") {
+    return next();
+  }
+  await send_queue.send(
+    ctx.state.user,
+    ctx.state.room_channel,
+    ctx.state.message
+  );
+  ctx.body = {};
+};
+
+assembly.use(queue_send_message);
+
+//compressed message bodies are decoded before they reach the ui
+assembly.use(decode_message_bodies);
+
 //the routes middleware for the assembly functions
 assembly.use(assembly_router.middleware());
 
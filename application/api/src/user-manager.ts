@@ -4,18 +4,99 @@ import { networkClient, nodeClient } from "./assembly-wrapper";
 
 const users_db_location = `${__dirname}/../users.json`;
 const api_header = "/api";
+//changes made within this many milliseconds are written in one go
+const FLUSH_DELAY_MS = 100;
 
-//create the local "db" of usernames
-//(it's just a json file)
-if (!fs.existsSync(users_db_location)) {
-  fs.writeFileSync(users_db_location, "{}");
-} else {
+type User = {
+  ip: string;
+  ka: string;
+  allowed: boolean;
+  contacts: { [ka: string]: string };
+};
+
+//the local "db" of usernames, kept in memory and written back to
+//a json file shortly after each change
+let user_db: { [user: string]: User } = {};
+//key alias -> username
+let users_by_ka: Map<string, string> = new Map();
+let dirty = false;
+let flush_timer: NodeJS.Timeout | undefined;
+let flushing: Promise<void> = Promise.resolve();
+
+/**
+ * (re)loads the users database from disk, creating it if it is missing
+ * or unreadable. Changes that haven't been written yet are discarded
+ */
+export const load_users = function load_users() {
+  if (flush_timer) {
+    clearTimeout(flush_timer);
+    flush_timer = undefined;
+  }
+  dirty = false;
   try {
-    JSON.parse(fs.readFileSync(users_db_location, "utf-8"));
+    user_db = JSON.parse(fs.readFileSync(users_db_location, "utf-8"));
   } catch {
+    user_db = {};
     fs.writeFileSync(users_db_location, "{}");
   }
-}
+  users_by_ka = new Map();
+  for (let user of Object.keys(user_db)) {
+    users_by_ka.set(user_db[user].ka, user);
+  }
+};
+
+//writes to a temporary file first, so that a crash mid-write
+//never leaves a truncated database behind
+const write_users = async function write_users() {
+  let tmp_location = `${users_db_location}.tmp`;
+  await fs.promises.writeFile(tmp_location, JSON.stringify(user_db));
+  await fs.promises.rename(tmp_location, users_db_location);
+};
+
+//a failed write leaves the changes marked dirty, so that they are retried
+//by the next flush instead of being lost, and the chain stays resolved
+const try_write_users = async function try_write_users() {
+  try {
+    await write_users();
+  } catch (e) {
+    console.error(`Failed to write ${users_db_location}: ${e}`);
+    mark_dirty();
+  }
+};
+
+/**
+ * writes pending changes to disk now instead of waiting for the timer
+ * @returns a promise that resolves once the write has been attempted.
+ * Failed writes are retried, it never rejects
+ */
+export const flush_users = async function flush_users(): Promise<void> {
+  if (flush_timer) {
+    clearTimeout(flush_timer);
+    flush_timer = undefined;
+  }
+  if (dirty) {
+    dirty = false;
+    //writes are chained so that an older snapshot never lands last
+    flushing = flushing.then(try_write_users);
+  }
+  return flushing;
+};
+
+const mark_dirty = function mark_dirty() {
+  dirty = true;
+  if (!flush_timer) {
+    flush_timer = setTimeout(flush_users, FLUSH_DELAY_MS);
+  }
+};
+
+load_users();
+process.on("exit", () => {
+  //pending changes are written synchronously, async work won't run now
+  if (dirty) {
+    fs.writeFileSync(`${users_db_location}.tmp`, JSON.stringify(user_db));
+    fs.renameSync(`${users_db_location}.tmp`, users_db_location);
+  }
+});
 
 //auth middleware
 export const auth_middleware = async (ctx: Context, next: any) => {
@@ -55,7 +136,6 @@ export const user_is_authorized = async function user_is_authorized(
   user: string,
   ip: string
 ): Promise<boolean> {
-  let user_db = JSON.parse(fs.readFileSync(users_db_location, "utf-8"));
   if (user_db[user]) {
     return user_db[user]["ip"] == ip && user_db[user]["allowed"];
   }
@@ -71,7 +151,6 @@ export const user_is_authorized = async function user_is_authorized(
 export const create_user = async function create_user(
   ip: string
 ): Promise<string> {
-  let user_db = JSON.parse(fs.readFileSync(users_db_location, "utf-8"));
   let user = await nodeClient.registerKeyAlias();
   if (user_db[user]) {
     return Promise.reject(new Error("Key alias already exists!?"));
@@ -82,7 +161,8 @@ export const create_user = async function create_user(
     allowed: true,
     contacts: {},
   };
-  fs.writeFileSync(users_db_location, JSON.stringify(user_db));
+  users_by_ka.set(user, user);
+  mark_dirty();
   return Promise.resolve(user);
 };
 
@@ -94,7 +174,6 @@ export const create_user = async function create_user(
 export const get_ka_from_user = async function get_user_ka(
   user: string
 ): Promise<string> {
-  let user_db = JSON.parse(fs.readFileSync(users_db_location, "utf-8"));
   if (await is_key_alias(user)) {
     return user;
   }
@@ -114,12 +193,9 @@ export const get_user_from_ka = async function get_user_from_ka(
   contacts_list_owner: string = "",
   suppress_error: boolean = true
 ): Promise<string> {
-  let user_db = JSON.parse(fs.readFileSync(users_db_location, "utf-8"));
-
-  for (let user of Object.keys(user_db)) {
-    if (ka === user_db[user].ka) {
-      return user;
-    }
+  let user = users_by_ka.get(ka);
+  if (user !== undefined) {
+    return user;
   }
 
   if (!suppress_error) {
@@ -129,12 +205,24 @@ export const get_user_from_ka = async function get_user_from_ka(
   }
 };
 
+/**
+ * checks if a key alias belongs to a user of this api, which is the only
+ * kind of key alias calls can be made as
+ * @param ka key alias
+ * @returns boolean
+ */
+export const is_local_key_alias = function is_local_key_alias(
+  ka: string
+): boolean {
+  return users_by_ka.has(ka);
+};
+
 /**
  * this function will get a list of users
  * @returns list string[] of users
  */
 export const list_users = async function list_users(): Promise<string[]> {
-  return Object.keys(JSON.parse(fs.readFileSync(users_db_location, "utf-8")));
+  return Object.keys(user_db);
 };
 
 /**
@@ -154,14 +242,13 @@ export const is_key_alias = async function is_key_alias(
  * @param user username of user to delete
  */
 export const remove_user = async function remove_user(user: string) {
-  let user_db = JSON.parse(fs.readFileSync(users_db_location, "utf-8"));
   if (!user_db[user]) {
     return Promise.reject(Error("Username does not exist!"));
   }
   let ka = user_db[user]["ka"];
   await nodeClient.deregisterKeyAlias(ka);
   user_db[user]["allowed"] = false;
-  fs.writeFileSync(users_db_location, JSON.stringify(user_db));
+  mark_dirty();
 };
 
 export const add_contact = async function add_contact(
@@ -169,21 +256,18 @@ export const add_contact = async function add_contact(
   contact_key_alias: string,
   contact_name: string
 ) {
-  let user_db = JSON.parse(fs.readFileSync(users_db_location, "utf-8"));
   user_db[user].contacts[contact_key_alias] = contact_name;
-  fs.writeFileSync(users_db_location, JSON.stringify(user_db));
+  mark_dirty();
 };
 
 export const remove_contact = async function remove_contact(
   user: string,
   contact_key_alias: string
 ) {
-  let user_db = JSON.parse(fs.readFileSync(users_db_location, "utf-8"));
   delete user_db[user].contacts[contact_key_alias];
-  fs.writeFileSync(users_db_location, JSON.stringify(user_db));
+  mark_dirty();
 };
 
 export const get_contacts = async function get_contacts(user: string) {
-  let user_db = JSON.parse(fs.readFileSync(users_db_location, "utf-8"));
   return user_db[user].contacts ? user_db[user].contacts : [];
 };
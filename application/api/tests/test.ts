@@ -8,7 +8,13 @@ import fs from "fs";
 import { Context, Request } from "koa";
 import { expect } from "chai";
 //import applicaation modules
-import { networkClient, chat, nodeClient } from "../src/assembly-wrapper";
+import {
+  networkClient,
+  chat,
+  nodeClient,
+  SendQueue,
+  NodePool,
+} from "../src/assembly-wrapper";
 import * as userManager from "../src/user-manager";
 import {
   createUser,
@@ -18,7 +24,11 @@ import {
   updateContact,
 } from "../src/routes/local_api";
 import * as api_middlewares from "../src/routes/chat";
-import { updateCache } from "../src/message-cache";
+import { updateCache, message_cache } from "../src/message-cache";
+import { sparks, with_message, handle_event } from "../src/events-manager";
+import { decode_message_bodies } from "../src/message-codec";
+import { RoomMembership } from "../src/room-membership";
+import * as zlib from "zlib";
 //use chai extensions
 chai.use(chaiAsPromised);
 chai.use(chaiThings);
@@ -51,6 +61,7 @@ let rks = Sinon.stub(nodeClient, "registerKeyAlias").returns(create_new_ka());
 describe("User Manager", async () => {
   beforeEach(() => {
     fs.writeFileSync("users.json", "{}");
+    userManager.load_users();
   });
   it("tests creating user and getting key_alias", async () => {
     let demo_ka = create_new_ka();
@@ -60,6 +71,48 @@ describe("User Manager", async () => {
     chai.expect(ka).to.equal(demo_ka);
   });
 
+  it("tests writing changes behind in one batch", async () => {
+    rks.callsFake(create_new_ka);
+    let alice = await userManager.create_user("0.0.0.0");
+    let bob = await userManager.create_user("0.0.0.0");
+    await userManager.add_contact(alice, bob, "bob");
+    //nothing is written until the batch is flushed
+    chai.expect(JSON.parse(fs.readFileSync("users.json", "utf-8"))).to.eql({});
+    await userManager.flush_users();
+    let user_db = JSON.parse(fs.readFileSync("users.json", "utf-8"));
+    chai.expect(Object.keys(user_db)).to.have.members([alice, bob]);
+    chai.expect(user_db[alice].contacts[bob]).to.equal("bob");
+    chai.expect(fs.existsSync("users.json.tmp")).to.be.false;
+  });
+  it("tests retrying a failed write with the next flush", async () => {
+    rks.callsFake(create_new_ka);
+    let rename = Sinon.stub(fs.promises, "rename");
+    rename.onFirstCall().rejects(new Error("disk full"));
+    rename.callThrough();
+    let error = Sinon.stub(console, "error");
+    try {
+      let alice = await userManager.create_user("0.0.0.0");
+      await expect(userManager.flush_users()).to.be.fulfilled;
+      let on_disk = JSON.parse(fs.readFileSync("users.json", "utf-8"));
+      chai.expect(on_disk).to.eql({});
+      await userManager.flush_users();
+      let user_db = JSON.parse(fs.readFileSync("users.json", "utf-8"));
+      chai.expect(Object.keys(user_db)).to.eql([alice]);
+    } finally {
+      rename.restore();
+      error.restore();
+    }
+  });
+  it("tests looking up users by key alias after a reload", async () => {
+    rks.callsFake(create_new_ka);
+    let alice = await userManager.create_user("0.0.0.0");
+    await userManager.flush_users();
+    userManager.load_users();
+    await expect(userManager.get_user_from_ka(alice, "", false)).to.eventually
+      .equal(alice);
+    await expect(userManager.get_user_from_ka(create_new_ka(), "", false)).to
+      .be.rejected;
+  });
   it("tests user authorized", async () => {
     rks.callsFake(create_new_ka);
     let user = await userManager.create_user("0.0.0.0");
@@ -146,6 +199,7 @@ describe("User Manager", async () => {
 describe("Local Api Routes", async () => {
   beforeEach(() => {
     fs.writeFileSync("users.json", "{}");
+    userManager.load_users();
   });
   it("tests creating a user", async () => {
     let demo_ka = create_new_ka();
@@ -171,11 +225,11 @@ describe("Local Api Routes", async () => {
 
   it("tests get message from message cache", async () => {
     let messages: any[] = [
-      { message_id: "m1", message: "Hello " },
-      { message_id: "m2", message: "World!" },
+      { message_id: "m1", message: "Hello ", seq: 1 },
+      { message_id: "m2", message: "World!", seq: 2 },
     ];
 
-    Sinon.stub(chat, "getMessages").returns(
+    Sinon.stub(chat, "getMessagesAfter").returns(
       new Promise<any[]>((res, rej) => {
         res(messages);
       })
@@ -189,6 +243,7 @@ describe("Local Api Routes", async () => {
     chai.expect(context.body["message"]).to.eql({
       message_id: "m1",
       message: "Hello ",
+      seq: 1,
     });
   });
   it("tests adding and getting contact", async () => {
@@ -240,6 +295,39 @@ describe("Local Api Routes", async () => {
 describe("Chat Middleware", async () => {
   beforeEach(() => {
     fs.writeFileSync("users.json", "{}");
+    userManager.load_users();
+  });
+
+  it("tests decoding compressed message bodies", async () => {
+    let context = create_new_context();
+    let body = "hello ".repeat(500);
+    await decode_message_bodies(context, () => {
+      context.body = [
+        {
+          message_id: "m1",
+          body: zlib.deflateSync(Buffer.from(body)).toString("base64"),
+          encoding: "zlib+base64",
+        },
+        { message_id: "m2", body: "plain", encoding: "" },
+      ];
+    });
+    expect(context.body).to.eql([
+      { message_id: "m1", body: body, encoding: "" },
+      { message_id: "m2", body: "plain", encoding: "" },
+    ]);
+  });
+
+  it("tests decoding a single compressed message body", async () => {
+    let context = create_new_context();
+    let body = "hello ".repeat(500);
+    await decode_message_bodies(context, () => {
+      context.body = {
+        message_id: "m1",
+        body: zlib.deflateSync(Buffer.from(body)).toString("base64"),
+        encoding: "zlib+base64",
+      };
+    });
+    expect(context.body).to.eql({ message_id: "m1", body: body, encoding: "" });
   });
 
   it("tests moving query params to the state object", async () => {
@@ -258,3 +346,362 @@ describe("Chat Middleware", async () => {
     });
   });
 });
+
+describe("Room Membership", async () => {
+  it("tests applying consecutive deltas", async () => {
+    let membership = new RoomMembership(async () => undefined);
+    membership.apply_snapshot({ channel: "RID-1", version: 0, members: ["a"] });
+    let members = await membership.apply_delta({
+      room_channel: "RID-1",
+      room_version: 1,
+      action: "invite",
+      actor: "a",
+      member: "b",
+    });
+    expect(members).to.eql(["a", "b"]);
+    members = await membership.apply_delta({
+      room_channel: "RID-1",
+      room_version: 2,
+      action: "remove",
+      actor: "a",
+      member: "b",
+    });
+    expect(members).to.eql(["a"]);
+    expect(membership.snapshots_fetched).to.equal(0);
+  });
+  it("tests fetching a snapshot after a version gap", async () => {
+    let membership = new RoomMembership(async (room_channel) => {
+      return { channel: room_channel, version: 3, members: ["a", "c"] };
+    });
+    membership.apply_snapshot({ channel: "RID-1", version: 0, members: ["a"] });
+    let members = await membership.apply_delta({
+      room_channel: "RID-1",
+      room_version: 3,
+      action: "invite",
+      actor: "a",
+      member: "c",
+    });
+    expect(members).to.eql(["a", "c"]);
+    expect(membership.snapshots_fetched).to.equal(1);
+  });
+  it("tests fetching a snapshot through a remaining member", async () => {
+    let readers = [];
+    let membership = new RoomMembership(async (room_channel, members) => {
+      readers = members;
+      return { channel: room_channel, version: 5, members: ["a", "c"] };
+    });
+    membership.apply_snapshot({
+      channel: "RID-1",
+      version: 2,
+      members: ["a", "b", "c"],
+    });
+    await membership.apply_delta({
+      room_channel: "RID-1",
+      room_version: 5,
+      action: "remove",
+      actor: "c",
+      member: "b",
+    });
+    //the removee can no longer read the room
+    expect(readers).to.have.members(["a", "c"]);
+  });
+  it("tests keeping deltas applied over same-version snapshots", async () => {
+    let membership = new RoomMembership(async () => undefined);
+    membership.apply_snapshot({ channel: "RID-1", version: 0, members: ["a"] });
+    await membership.apply_delta({
+      room_channel: "RID-1",
+      room_version: 1,
+      action: "invite",
+      actor: "a",
+      member: "b",
+    });
+    //a later event carrying the room at the same version changes nothing
+    let known = membership.rooms["RID-1"];
+    membership.apply_snapshot({
+      channel: "RID-1",
+      version: 1,
+      members: ["a", "b"],
+    });
+    expect(membership.rooms["RID-1"]).to.equal(known);
+  });
+  it("tests ignoring deltas already applied from a snapshot", async () => {
+    let membership = new RoomMembership(async () => undefined);
+    membership.apply_snapshot({
+      channel: "RID-1",
+      version: 1,
+      members: ["a", "b"],
+    });
+    let members = await membership.apply_delta({
+      room_channel: "RID-1",
+      room_version: 1,
+      action: "invite",
+      actor: "a",
+      member: "b",
+    });
+    expect(members).to.eql(["a", "b"]);
+    expect(membership.snapshots_fetched).to.equal(0);
+  });
+});
+
+describe("Send Queue", async () => {
+  it("tests coalescing sends per sender and room", async () => {
+    let batches = [];
+    let queue = new SendQueue(async (ka, room, messages) => {
+      batches.push([ka, room, messages]);
+    }, 5);
+    await Promise.all([
+      queue.send("KA-1", "RID-1", "a"),
+      queue.send("KA-1", "RID-1", "b"),
+      queue.send("KA-2", "RID-1", "c"),
+      queue.send("KA-1", "RID-2", "d"),
+    ]);
+    expect(batches).to.have.deep.members([
+      ["KA-1", "RID-1", ["a", "b"]],
+      ["KA-2", "RID-1", ["c"]],
+      ["KA-1", "RID-2", ["d"]],
+    ]);
+    expect(queue.metrics.batches).to.equal(3);
+    expect(queue.metrics.messages_sent).to.equal(4);
+    expect(queue.depth).to.equal(0);
+  });
+  it("tests sending full batches without waiting", async () => {
+    let batches = [];
+    let queue = new SendQueue(
+      async (ka, room, messages) => {
+        batches.push(messages);
+      },
+      60000,
+      2
+    );
+    await Promise.all([
+      queue.send("KA-1", "RID-1", "a"),
+      queue.send("KA-1", "RID-1", "b"),
+    ]);
+    expect(batches).to.eql([["a", "b"]]);
+  });
+  it("tests refusing sends when the queue is full", async () => {
+    let queue = new SendQueue(async () => {}, 5, 50, 2);
+    let sent = [
+      queue.send("KA-1", "RID-1", "a"),
+      queue.send("KA-1", "RID-1", "b"),
+    ];
+    await expect(queue.send("KA-1", "RID-1", "c")).to.be.rejectedWith(
+      "Too many messages queued"
+    );
+    await Promise.all(sent);
+    expect(queue.metrics.rejected).to.equal(1);
+    expect(queue.metrics.max_depth).to.equal(2);
+  });
+  it("tests failing every message of a failed batch", async () => {
+    let queue = new SendQueue(async () => {
+      throw new Error("Room has been deleted");
+    }, 5);
+    let sent = [
+      queue.send("KA-1", "RID-1", "a"),
+      queue.send("KA-1", "RID-1", "b"),
+    ];
+    for (let send of sent) {
+      await expect(send).to.be.rejectedWith("Room has been deleted");
+    }
+    expect(queue.depth).to.equal(0);
+  });
+});
+
+describe("Message Push", async () => {
+  let get_message: Sinon.SinonStub;
+  beforeEach(() => {
+    get_message = Sinon.stub(chat, "getMessage");
+  });
+  afterEach(() => {
+    get_message.restore();
+    delete sparks["KA-1"];
+  });
+  it("tests adding the message to a SendMessageEvent", async () => {
+    sparks["KA-1"] = ["spark-1"];
+    get_message.resolves({
+      message_id: "m3",
+      body: "hello",
+      encoding: "",
+      seq: 3,
+    });
+    let e = {
+      type: "chat/SendMessageEvent",
+      data: { room: { channel: "RID-1", members: ["KA-1"] }, message_id: "m3" },
+    };
+    let pushed = await with_message(e);
+    expect(pushed.data.message.body).to.equal("hello");
+    expect(get_message.calledOnceWith("KA-1", "RID-1", "m3")).to.be.true;
+  });
+  it("tests leaving the event as is without a connected member", async () => {
+    let e = {
+      type: "chat/SendMessageEvent",
+      data: { room: { channel: "RID-2", members: ["KA-2"] }, message_id: "m1" },
+    };
+    expect(await with_message(e)).to.equal(e);
+    expect(get_message.called).to.be.false;
+    expect(message_cache["RID-2"]).to.be.undefined;
+  });
+  it("measures push-mode delivery latency through handle_event", async () => {
+    //the node answers every read after `node_delay` milliseconds, so the
+    //latency is one read plus the api's own work, for any number of members
+    let node_delay = 5;
+    get_message.callsFake(async (ka, room_channel, message_id) => {
+      await new Promise((resolve) => setTimeout(resolve, node_delay));
+      return { message_id: message_id, body: message_id, encoding: "" };
+    });
+    let members = ["KA-1", "KA-2", "KA-3", "KA-4", "KA-5"];
+    let writes = [];
+    let primus = { spark: () => ({ write: (data) => writes.push(data) }) };
+    members.forEach((member) => (sparks[member] = [`spark-${member}`]));
+    let latencies = [];
+    try {
+      for (let i = 0; i < 20; i++) {
+        writes = [];
+        let e = {
+          type: "chat/SendMessageEvent",
+          data: { room: { channel: "RID-3", members }, message_id: `m${i}` },
+        };
+        let start = process.hrtime();
+        await handle_event(primus as any, e, true);
+        let [seconds, nanoseconds] = process.hrtime(start);
+        latencies.push(seconds * 1e3 + nanoseconds / 1e6);
+        expect(writes.map((w) => w.data.message.body)).to.eql(
+          members.map(() => `m${i}`)
+        );
+      }
+    } finally {
+      members.forEach((member) => delete sparks[member]);
+    }
+    //the whole room is served by a single read per message
+    expect(get_message.callCount).to.equal(20);
+    latencies.sort((a, b) => a - b);
+    let median = latencies[latencies.length >> 1];
+    console.log(
+      `push: median ${median.toFixed(2)}ms, ` +
+        `max ${latencies[latencies.length - 1].toFixed(2)}ms`
+    );
+    expect(median).to.be.at.least(node_delay);
+  });
+});
+
+describe("Event Handling", async () => {
+  afterEach(() => {
+    delete sparks["KA-1"];
+  });
+  it("tests ignoring membership deltas without delta_events", async () => {
+    let write = Sinon.spy();
+    let primus = { spark: () => ({ write: write }) };
+    sparks["KA-1"] = ["spark-1"];
+    let e = {
+      type: "chat/10-1.0.0/MembershipDeltaEvent",
+      data: {
+        room_channel: "RID-1",
+        room_version: 1,
+        action: "invite",
+        actor: "KA-2",
+        member: "KA-1",
+      },
+    };
+    await expect(handle_event(primus as any, e)).to.be.fulfilled;
+    expect(write.called).to.be.false;
+  });
+  it("tests pushing room events to the room's members", async () => {
+    let write = Sinon.spy();
+    let primus = { spark: () => ({ write: write }) };
+    sparks["KA-1"] = ["spark-1"];
+    let e = {
+      type: "chat/DeleteRoomEvent",
+      data: { room: { channel: "RID-1", members: ["KA-1"] } },
+    };
+    await handle_event(primus as any, e);
+    expect(write.calledOnceWith({ event: e.type, data: e.data })).to.be.true;
+  });
+});
+
+describe("Node Pool", async () => {
+  //a local stand-in for a node, answering after `delay` milliseconds
+  class MockNode {
+    in_flight = 0;
+    max_in_flight = 0;
+    healthy = true;
+    calls: string[] = [];
+    constructor(public name: string, public delay = 5) {}
+    async call(what: string) {
+      this.in_flight++;
+      this.max_in_flight = Math.max(this.max_in_flight, this.in_flight);
+      this.calls.push(what);
+      await new Promise((res) => setTimeout(res, this.delay));
+      this.in_flight--;
+      return this.name;
+    }
+    async ping() {
+      if (!this.healthy) {
+        throw new Error("down");
+      }
+    }
+  }
+
+  it("tests limiting concurrent calls per node", async () => {
+    let node = new MockNode("a");
+    let pool = new NodePool([node], (n) => n.ping(), 2);
+    await Promise.all(
+      [...Array(6).keys()].map((i) => pool.read((n) => n.call(`r${i}`)))
+    );
+    expect(node.calls.length).to.equal(6);
+    expect(node.max_in_flight).to.equal(2);
+  });
+  it("tests sending reads to the least loaded node", async () => {
+    let slow = new MockNode("slow", 50);
+    let fast = new MockNode("fast", 1);
+    let pool = new NodePool([slow, fast], (n) => n.ping(), 4);
+    let first = pool.read((n) => n.call("r0"));
+    let rest = await Promise.all(
+      [1, 2, 3].map((i) => pool.read((n) => n.call(`r${i}`)))
+    );
+    await first;
+    //the first read is busy on one node, so the next goes to the other
+    expect(rest[0]).to.not.equal(await first);
+  });
+  it("tests keeping writes for a room on one node", async () => {
+    let nodes = [new MockNode("a"), new MockNode("b"), new MockNode("c")];
+    let pool = new NodePool(nodes, (n) => n.ping());
+    let chosen = [];
+    for (let i = 0; i < 5; i++) {
+      chosen.push(await pool.write("RID-1", (n) => n.call(`w${i}`)));
+    }
+    expect(new Set(chosen).size).to.equal(1);
+  });
+  it("tests running the writes of a room one at a time", async () => {
+    let node = new MockNode("a");
+    let pool = new NodePool([node], (n) => n.ping());
+    let failed = pool.write("RID-1", async () => {
+      throw new Error("failed");
+    });
+    await Promise.all([
+      ...[0, 1, 2].map((i) => pool.write("RID-1", (n) => n.call(`w${i}`))),
+      failed.catch(() => {}),
+    ]);
+    //a failed write doesn't stop the ones after it
+    expect(node.calls).to.deep.equal(["w0", "w1", "w2"]);
+    expect(node.max_in_flight).to.equal(1);
+    //writes for different rooms still run at once
+    await Promise.all(
+      ["RID-1", "RID-2"].map((room) => pool.write(room, (n) => n.call(room)))
+    );
+    expect(node.max_in_flight).to.equal(2);
+  });
+  it("tests moving writes off a node that fails its health check", async () => {
+    let nodes = [new MockNode("a"), new MockNode("b")];
+    let pool = new NodePool(nodes, (n) => n.ping());
+    let before = await pool.write("RID-1", (n) => n.call("w0"));
+    nodes.find((n) => n.name === before).healthy = false;
+    await pool.check_nodes();
+    let after = await pool.write("RID-1", (n) => n.call("w1"));
+    expect(after).to.not.equal(before);
+    expect(pool.stats().filter((s) => !s.healthy).length).to.equal(1);
+    //a node is used again once it passes a check
+    nodes.forEach((n) => (n.healthy = true));
+    await pool.check_nodes();
+    expect(await pool.write("RID-1", (n) => n.call("w2"))).to.equal(before);
+  });
+});
@@ -15,7 +15,12 @@ primus.on("data", async (data) => {
     //if it is the correct message
     switch (event) {
       case "SendMessageEvent":
-        get_message_and_add(data.data.message_id, data.data.room.channel);
+        //the api may push the message with the event
+        if (data.data.message) {
+          add_message(data.data.message, data.data.room.channel);
+        } else {
+          get_message_and_add(data.data.message_id, data.data.room.channel);
+        }
         if (room_channel !== data.data.room.channel) {
           document
             .querySelector("#" + data.data.room.channel)
@@ -90,6 +95,9 @@ primus.on("data", async (data) => {
           false
         );
         break;
+      case "MembershipDeltaEvent":
+        handle_membership_delta(data.data);
+        break;
       case "CreateRoomEvent":
         add_room(data.data.room);
         break;
@@ -103,3 +111,55 @@ primus.on("data", async (data) => {
     console.log(data);
   }
 });
+
+//membership changes are sent as compact deltas when the api runs
+//with `delta_events`, these don't carry the room itself
+async function handle_membership_delta(delta) {
+  let actor = get_friendly_contact_name(delta.actor);
+  let member = get_friendly_contact_name(delta.member);
+  switch (delta.action) {
+    case "invite":
+      add_message(`${actor} added ${member}`, delta.room_channel, false);
+      //fetch the room the first time it is seen
+      if (
+        ![...document.querySelector("#room-items").children]
+          .map((e) => e.id)
+          .includes(delta.room_channel)
+      ) {
+        let rooms = await call_api("POST", "get_rooms");
+        if (!rooms.error) {
+          let room = rooms.find((r) => r.channel === delta.room_channel);
+          if (room) {
+            add_room(room);
+          }
+        }
+      }
+      if (
+        room_channel === delta.room_channel &&
+        delta.member === localStorage.username
+      ) {
+        document.querySelector("#send-message.room-specific").style.visibility =
+          "visible";
+      }
+      break;
+    case "remove":
+      if (delta.member == localStorage.username) {
+        add_message(
+          `You have been removed from the room by ${actor}`,
+          delta.room_channel,
+          false
+        );
+        document.querySelector("#send-message.room-specific").style.visibility =
+          "hidden";
+      } else {
+        add_message(`${actor} removed ${member}`, delta.room_channel, false);
+      }
+      break;
+    case "promote":
+      add_message(`${actor} promoted ${member}`, delta.room_channel, false);
+      break;
+    case "demote":
+      add_message(`${actor} demoted ${member}`, delta.room_channel, false);
+      break;
+  }
+}
@@ -0,0 +1,93 @@
+"""
+Tests for the read-through cache around the Chat client.
+"""
+
+import pytest
+
+from utils.chat_10_1_0_0_cache import CachingChatClient
+from utils.chat_10_1_0_0_events import EventSubscription
+
+
+class CountingNode:
+    """A node with a long event log, counting the events it returns and the contract reads it serves."""
+
+    def __init__(self, log_size):
+        self.log = [{'type': 'chat/10-1.0.0/SendMessageEvent', 'data': {'room': {'channel': 'RID-1'}}}] * log_size
+        self.events_returned = 0
+        self.reads = 0
+        self.chat = {'10-1.0.0': self}
+
+    def events(self, since=0):
+        events = self.log[since:]
+        self.events_returned += len(events)
+        return events
+
+    def get_rooms(self):
+        self.reads += 1
+        return [{'channel': 'RID-1', 'name': 'room'}]
+
+
+@pytest.mark.usefixtures('network', 'store', 'cached_chat_10')
+class TestChatCache():
+    def test_repeated_reads_hit(self, cached_chat_10):
+        room = cached_chat_10('alice').create_room(room_name='room')['room']['channel']
+        cached_chat_10('alice').get_messages(room_channel=room)
+        cached_chat_10('alice').get_messages(room_channel=room)
+        cached_chat_10('alice').get_rooms()
+        cached_chat_10('alice').get_rooms()
+        assert cached_chat_10('alice').stats()['hits'] == 2
+        assert cached_chat_10('alice').stats()['misses'] == 2
+
+    def test_single_message_reads_hit(self, network, store, cached_chat_10):
+        room = cached_chat_10('alice').create_room(room_name='room')['room']['channel']
+        alice_events = EventSubscription(network[store['alice']])
+        message_id = cached_chat_10('alice').send_message(room_channel=room, message='message')['message_id']
+        alice_events.wait_for('SendMessageEvent')
+        cached_chat_10('alice').get_messages(room_channel=room)
+        for _ in range(2):
+            assert cached_chat_10('alice').get_message(room_channel=room, message_id=message_id)['body'] == 'message'
+        # the single message reads don't drop the cached history
+        cached_chat_10('alice').get_messages(room_channel=room)
+        assert cached_chat_10('alice').stats()['hits'] == 2
+
+    def test_other_members_messages_invalidate(self, network, store, cached_chat_10):
+        """A message sent by another member reaches the cache through its SendMessageEvent."""
+        room = cached_chat_10('alice').create_room(room_name='room')['room']['channel']
+        cached_chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
+        assert cached_chat_10('alice').get_messages(room_channel=room) == []
+        alice_events = EventSubscription(network[store['alice']])
+        cached_chat_10('bob').send_message(room_channel=room, message='message')
+        alice_events.wait_for('SendMessageEvent')
+        messages = cached_chat_10('alice').get_messages(room_channel=room)
+        assert [message['body'] for message in messages] == ['message']
+        assert cached_chat_10('alice').stats()['invalidations'] > 0
+
+    def test_removal_invalidates_room_list(self, store, cached_chat_10):
+        room = cached_chat_10('alice').create_room(room_name='room')['room']['channel']
+        cached_chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
+        assert cached_chat_10('bob').get_rooms()[0]['members'] == [store['alice'], store['bob']]
+        cached_chat_10('alice').remove_from_room(room_channel=room, member_to_remove=store['bob'])
+        assert cached_chat_10('bob').get_rooms()[0]['members'] == [store['alice']]
+
+    def test_cached_results_are_copies(self, cached_chat_10):
+        cached_chat_10('alice').create_room(room_name='room')
+        rooms = cached_chat_10('alice').get_rooms()
+        del rooms[0]['channel']
+        assert 'channel' in cached_chat_10('alice').get_rooms()[0]
+
+
+class TestChatCacheReads():
+    def test_hits_do_not_read_the_event_log(self):
+        node = CountingNode(log_size=10000)
+        client = CachingChatClient(node)
+        client.get_rooms()
+        node.events_returned = 0
+        for _ in range(100):
+            client.get_rooms()
+        assert node.events_returned == 0
+        assert node.reads == 1
+        # a new event is read once, and drops the cached rooms
+        node.log = node.log + node.log[:1]
+        client.get_rooms()
+        assert node.events_returned == 1
+        assert node.reads == 2
@@ -0,0 +1,30 @@
+"""
+Tests for compressed message bodies.
+"""
+
+import pytest
+
+from utils.chat_10_1_0_0_codec import BodyCodec, PLAIN, ZLIB_BASE64
+
+
+class TestBodyCodec():
+    def test_short_bodies_stay_plain(self):
+        assert BodyCodec(threshold=100).encode('message') == ('message', PLAIN)
+
+    def test_round_trip(self):
+        codec = BodyCodec(threshold=100)
+        text = 'message ' * 500
+        body, encoding = codec.encode(text)
+        assert encoding == ZLIB_BASE64
+        assert len(body) < len(text)
+        assert codec.decode({'body': body, 'encoding': encoding, 'seq': 1}) == {'body': text, 'encoding': PLAIN, 'seq': 1}
+        assert codec.stats()['stored_bytes'] == len(body)
+        assert codec.stats()['read_text_bytes'] == len(text)
+
+    def test_incompressible_bodies_stay_plain(self):
+        text = ''.join(chr(0x4e00 + (i * 7919) % 20000) for i in range(2000))
+        assert BodyCodec(threshold=100).encode(text) == (text, PLAIN)
+
+    def test_rejects_long_text(self):
+        with pytest.raises(ValueError):
+            BodyCodec().encode('m' * 4001)
@@ -7,6 +7,7 @@ import pytest
 from assembly_client.api.types.error_types import ContractError
 
 import utils.chat_10_1_0_0_test_utils as utils
+from utils.chat_10_1_0_0_codec import CompressingChatClient, ZLIB_BASE64
 
 
 def _assert_error(e, expected):
@@ -52,8 +53,7 @@ class TestChatCoverage():
         chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
         chat_10('alice').send_message(room_channel=room, message='message')
         messages = chat_10('bob').get_messages(room_channel=room)
-        utils.scrub_ids_and_timestamps(messages)
-        assert messages == [{'sender': store['alice'], 'body': 'message'}]
+        utils.assert_results_equal([{'sender': store['alice'], 'body': 'message', 'seq': 1, 'encoding': ''}], messages)
 
     def test_user_removal(self, store, chat_10):
         """After a user is removed they should no longer be able to read new messages from a room."""
@@ -64,8 +64,19 @@ class TestChatCoverage():
         chat_10('alice').remove_from_room(room_channel=room, member_to_remove=store['bob'])
         chat_10('alice').send_message(room_channel=room, message='nobob')
         messages = chat_10('bob').get_messages(room_channel=room)
-        utils.scrub_ids_and_timestamps(messages)
-        assert messages == [{'sender': store['alice'], 'body':'yesbob'}]
+        utils.assert_results_equal([{'sender': store['alice'], 'body':'yesbob', 'seq': 1, 'encoding': ''}], messages)
+
+    def test_send_after_removal(self, network, store, chat_10):
+        """A member other than the remover can send first after a removal, and the removee can't read that message."""
+        carol = network.register_key_alias()
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
+        chat_10('alice').invite_to_room(room_channel=room, new_member=carol)
+        chat_10('alice').send_message(room_channel=room, message='yescarol')
+        chat_10('alice').remove_from_room(room_channel=room, member_to_remove=carol)
+        chat_10('bob').send_message(room_channel=room, message='nocarol')
+        assert [m['body'] for m in chat_10('alice').get_messages(room_channel=room)] == ['yescarol', 'nocarol']
+        assert [m['body'] for m in network[carol].chat["10-1.0.0"].get_messages(room_channel=room)] == ['yescarol']
 
     def test_delete_room(self, store, chat_10):
         """Once a room is deleted, no user can send messages to it."""
@@ -93,6 +104,36 @@ class TestChatCoverage():
         rooms = chat_10('alice').get_rooms()
         assert (room not in [room['channel'] for room in rooms])
 
+    def test_get_room(self, store, chat_10):
+        """A single room is readable by its members only, and removed members lose access to it."""
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
+        assert chat_10('bob').get_room(room_channel=room) == chat_10('alice').get_rooms()[0]
+        chat_10('alice').remove_from_room(room_channel=room, member_to_remove=store['bob'])
+        assert chat_10('alice').get_room(room_channel=room)['members'] == [store['alice']]
+        with pytest.raises(ContractError) as e:
+            chat_10('bob').get_room(room_channel=room)
+        _assert_error(e, f"Room for channel {room} not found.")
+
+    def test_get_deleted_rooms(self, store, chat_10):
+        """Deleted rooms are listed to their owners only, until they are restored."""
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
+        chat_10('alice').delete_room(room_channel=room)
+        assert [room['channel'] for room in chat_10('alice').get_deleted_rooms()] == [room]
+        assert chat_10('bob').get_deleted_rooms() == []
+        chat_10('alice').restore_room(room_channel=room)
+        assert chat_10('alice').get_deleted_rooms() == []
+
+    def test_get_rooms_skips_deleted_rooms(self, store, chat_10):
+        """Room lists follow the status the room was deleted and restored with."""
+        kept = chat_10('alice').create_room(room_name='kept')['room']['channel']
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        chat_10('alice').delete_room(room_channel=room)
+        assert [room['channel'] for room in chat_10('alice').get_rooms()] == [kept]
+        chat_10('alice').restore_room(room_channel=room)
+        assert [room['channel'] for room in chat_10('alice').get_rooms()] == [kept, room]
+
     def test_restore_room(self, store, chat_10):
         """After a room is restored, users can send messages to it again."""
         create_room_event = chat_10('alice').create_room(room_name='room')
@@ -106,8 +147,137 @@ class TestChatCoverage():
         chat_10('alice').create_room(room_name='room_2')
         rooms = chat_10('alice').get_rooms()
         utils.scrub_channels(rooms)
-        assert rooms == [{'name': 'room_1', 'is_deleted': False, 'members': [store['alice']], 'owners':[store['alice']]},
-                         {'name': 'room_2', 'is_deleted': False, 'members': [store['alice']], 'owners':[store['alice']]}]
+        assert rooms == [{'name': 'room_1', 'is_deleted': False, 'members': [store['alice']], 'owners':[store['alice']], 'version': 0},
+                         {'name': 'room_2', 'is_deleted': False, 'members': [store['alice']], 'owners':[store['alice']], 'version': 0}]
+
+    def test_get_room_summaries(self, store, chat_10):
+        """Room summaries carry the message count and the last message of each room."""
+        room_1 = chat_10('alice').create_room(room_name='room_1')['room']['channel']
+        chat_10('alice').create_room(room_name='room_2')
+        chat_10('alice').send_message(room_channel=room_1, message='first')
+        chat_10('alice').send_message(room_channel=room_1, message='second')
+        summaries = chat_10('alice').get_room_summaries()
+        assert [summary['room']['name'] for summary in summaries] == ['room_1', 'room_2']
+        assert [summary['message_count'] for summary in summaries] == [2, 0]
+        last_message = chat_10('alice').get_messages(room_channel=room_1)[-1]
+        assert summaries[0]['last_message_id'] == last_message['message_id']
+        assert summaries[0]['last_activity'] == last_message['timestamp']
+        assert summaries[1]['last_message_id'] is None
+
+    def test_get_messages_after(self, store, chat_10):
+        """Messages are numbered in order, and can be read in pages after a known sequence number."""
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        for i in range(5):
+            chat_10('alice').send_message(room_channel=room, message=f"message {i}")
+        assert [message['seq'] for message in chat_10('alice').get_messages(room_channel=room)] == [1, 2, 3, 4, 5]
+        page = chat_10('alice').get_messages_after(room_channel=room, after_seq=1, limit=2)
+        assert [(message['seq'], message['body']) for message in page] == [(2, 'message 1'), (3, 'message 2')]
+        rest = chat_10('alice').get_messages_after(room_channel=room, after_seq=page[-1]['seq'], limit=10)
+        assert utils.find_sequence_gaps(rest, after_seq=3) == []
+        assert [message['seq'] for message in rest] == [4, 5]
+
+    def test_send_messages(self, store, chat_10):
+        """A batch of messages is stored in order, as if each had been sent on its own."""
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        chat_10('alice').send_messages(room_channel=room, messages=['one', 'two', 'three'])
+        messages = chat_10('alice').get_messages(room_channel=room)
+        assert [(message['seq'], message['body']) for message in messages] == [(1, 'one'), (2, 'two'), (3, 'three')]
+        with pytest.raises(ContractError) as e:
+            chat_10('alice').send_messages(room_channel=room, messages=['four', ''])
+        _assert_error(e, "Message cannot be empty.")
+        assert len(chat_10('alice').get_messages(room_channel=room)) == 3
+
+    def test_search_messages(self, store, chat_10):
+        """Search matches every word of the query, ignoring case and punctuation."""
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
+        chat_10('alice').send_message(room_channel=room, message='Lunch at noon?')
+        chat_10('bob').send_message(room_channel=room, message='noon works, lunch it is')
+        chat_10('bob').send_message(room_channel=room, message='see you at noon')
+        results = chat_10('bob').search_messages(room_channel=room, query='NOON lunch', limit=10)
+        assert [message['seq'] for message in results] == [1, 2]
+        results = chat_10('bob').search_messages(room_channel=room, query='noon', limit=2)
+        assert [message['seq'] for message in results] == [1, 2]
+        assert chat_10('bob').search_messages(room_channel=room, query='dinner', limit=10) == []
+        with pytest.raises(ContractError) as e:
+            chat_10('bob').search_messages(room_channel=room, query='', limit=10)
+        _assert_error(e, "Query cannot be empty.")
+
+    def test_search_messages_interleaved_postings(self, store, chat_10):
+        """Words whose postings interleave only match the messages that contain all of them."""
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        for message in ['red blue', 'red', 'blue', 'green red', 'blue red green', 'blue']:
+            chat_10('alice').send_message(room_channel=room, message=message)
+        results = chat_10('alice').search_messages(room_channel=room, query='blue red', limit=10)
+        assert [message['seq'] for message in results] == [1, 5]
+        results = chat_10('alice').search_messages(room_channel=room, query='green blue red', limit=10)
+        assert [message['seq'] for message in results] == [5]
+
+    def test_archive_room_history(self, store, chat_10):
+        """Archiving keeps the most recent messages in the room, and the older ones stay readable in the archive."""
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        for i in range(5):
+            chat_10('alice').send_message(room_channel=room, message=f"message {i}")
+        with pytest.raises(ContractError) as e:
+            chat_10('alice').archive_room_history(room_channel=room)
+        _assert_error(e, f"Room {room} has no retention limit.")
+        chat_10('alice').set_room_retention(room_channel=room, max_messages=2)
+        chat_10('alice').archive_room_history(room_channel=room)
+        assert [message['seq'] for message in chat_10('alice').get_messages(room_channel=room)] == [4, 5]
+        archived = chat_10('alice').get_archived_messages(room_channel=room, page=0)
+        assert [message['body'] for message in archived] == ['message 0', 'message 1', 'message 2']
+        assert chat_10('alice').get_archived_messages(room_channel=room, page=1) == []
+        with pytest.raises(ContractError) as e:
+            chat_10('alice').archive_room_history(room_channel=room)
+        _assert_error(e, f"Room {room} has nothing to archive.")
+
+    def test_only_owners_manage_retention(self, store, chat_10):
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
+        with pytest.raises(ContractError) as e:
+            chat_10('bob').set_room_retention(room_channel=room, max_messages=1)
+        _assert_error(e, f"{store['bob']} is not an owner of the room. Operation denied.")
+
+    def test_compressed_message(self, store, chat_10):
+        """Large bodies are stored compressed, and read back as the original text."""
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
+        message = 'hello bob ' * 400
+        CompressingChatClient(chat_10('alice')).send_message(room_channel=room, message=message)
+        stored = chat_10('bob').get_messages(room_channel=room)[0]
+        assert stored['encoding'] == ZLIB_BASE64
+        assert len(stored['body']) < len(message)
+        assert CompressingChatClient(chat_10('bob')).get_messages(room_channel=room)[0]['body'] == message
+
+    def test_unknown_message_encoding(self, store, chat_10):
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        with pytest.raises(ContractError) as e:
+            chat_10('alice').send_encoded_message(room_channel=room, message='message', encoding='rot13')
+        _assert_error(e, 'Unknown message encoding rot13.')
+
+    def test_get_room_digest(self, store, chat_10):
+        """Members of a room see the same digest, and it changes with every message and membership change."""
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        empty = chat_10('alice').get_room_digest(room_channel=room)
+        assert empty['message_count'] == 0
+        assert empty['history_digest'] == 0
+        chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
+        invited = chat_10('alice').get_room_digest(room_channel=room)
+        assert invited['membership_digest'] != empty['membership_digest']
+        chat_10('alice').send_message(room_channel=room, message='message')
+        sent = chat_10('alice').get_room_digest(room_channel=room)
+        assert sent['message_count'] == 1
+        assert sent['history_digest'] != invited['history_digest']
+        assert chat_10('bob').get_room_digest(room_channel=room) == sent
+
+    def test_room_digest_covers_encoding(self, store, chat_10):
+        """The same body stored in another encoding gives another digest."""
+        plain = chat_10('alice').create_room(room_name='room')['room']['channel']
+        encoded = chat_10('alice').create_room(room_name='room')['room']['channel']
+        chat_10('alice').send_message(room_channel=plain, message='message')
+        chat_10('alice').send_encoded_message(room_channel=encoded, message='message', encoding=ZLIB_BASE64)
+        assert (chat_10('alice').get_room_digest(room_channel=plain)['history_digest'] !=
+                chat_10('alice').get_room_digest(room_channel=encoded)['history_digest'])
 
     def test_get_rooms_change_after_person_left_and_promote_owner(self, network, store, chat_10):
         store['eve'] = network.register_key_alias()
@@ -121,8 +291,8 @@ class TestChatCoverage():
         bob_rooms = chat_10('bob').get_rooms()
         utils.scrub_channels(alice_rooms)
         utils.scrub_channels(bob_rooms)
-        assert alice_rooms == [{'name': 'room', 'is_deleted': False, 'members': [store['alice'], store['eve']], 'owners':[store['alice'], store['eve']]}]
-        assert bob_rooms == [{'name': 'room', 'is_deleted': False, 'members': [store['alice'], store['eve']], 'owners':[store['alice']]}]
+        assert alice_rooms == [{'name': 'room', 'is_deleted': False, 'members': [store['alice'], store['eve']], 'owners':[store['alice'], store['eve']], 'version': 4}]
+        assert bob_rooms == [{'name': 'room', 'is_deleted': False, 'members': [store['alice'], store['eve']], 'owners':[store['alice']], 'version': 3}]
 
     def test_demote_owner(self, store, chat_10):
         create_room_event = chat_10('alice').create_room(room_name='room')
@@ -131,11 +301,11 @@ class TestChatCoverage():
         chat_10('alice').promote_to_owner(member=store['bob'], room_channel=room)
         rooms = chat_10('alice').get_rooms()
         utils.scrub_channels(rooms)
-        assert rooms == [{'name': 'room', 'is_deleted': False, 'members': [store['alice'], store['bob']], 'owners':[store['alice'], store['bob']]}]
+        assert rooms == [{'name': 'room', 'is_deleted': False, 'members': [store['alice'], store['bob']], 'owners':[store['alice'], store['bob']], 'version': 2}]
         chat_10('alice').demote_owner(owner=store['bob'], room_channel=room)
         rooms = chat_10('alice').get_rooms()
         utils.scrub_channels(rooms)
-        assert rooms == [{'name': 'room', 'is_deleted': False, 'members': [store['alice'], store['bob']], 'owners':[store['alice']]}]
+        assert rooms == [{'name': 'room', 'is_deleted': False, 'members': [store['alice'], store['bob']], 'owners':[store['alice']], 'version': 3}]
 
     def test_get_rooms_sorted_by_name(self, store, chat_10):
         chat_10('alice').create_room(room_name='room_0')
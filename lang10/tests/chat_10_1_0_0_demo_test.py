@@ -84,16 +84,14 @@ class TestChatDemo():
     def test_alice_gets_both_messages(self, chat, room, store):
         """Alice should see 'Hello, Bob!' and 'Hey, Alice'."""
         messages = chat('alice').get_messages(room_channel=room)
-        utils.scrub_ids_and_timestamps(messages)
-        assert messages == [{'sender': store['alice'], 'body': 'Hello, Bob!'},
-                            {'sender': store['bob'], 'body': 'Hey, Alice'}]
+        utils.assert_results_equal([{'sender': store['alice'], 'body': 'Hello, Bob!', 'seq': 1, 'encoding': ''},
+                                    {'sender': store['bob'], 'body': 'Hey, Alice', 'seq': 2, 'encoding': ''}], messages)
 
     def test_bob_gets_both_messages(self, chat, room, store):
         """Bob should see 'Hello, Bob!' and 'Hey, Alice'."""
         messages = chat('bob').get_messages(room_channel=room)
-        utils.scrub_ids_and_timestamps(messages)
-        assert messages == [{'sender': store['alice'], 'body': 'Hello, Bob!'},
-                            {'sender': store['bob'], 'body': 'Hey, Alice'}]
+        utils.assert_results_equal([{'sender': store['alice'], 'body': 'Hello, Bob!', 'seq': 1, 'encoding': ''},
+                                    {'sender': store['bob'], 'body': 'Hey, Alice', 'seq': 2, 'encoding': ''}], messages)
 
     def test_eve_gets_neither_message(self, chat, room):
         """Eve, having not been invited, should see neither message."""
@@ -112,13 +110,12 @@ class TestChatDemo():
     def test_alice_gets_all_messages(self, chat, room, store):
         """Alice should see 'Hello, Bob!', 'Hey, Alice', and 'hi me'."""
         messages = chat('alice').get_messages(room_channel=room)
-        utils.scrub_ids_and_timestamps(messages)
-        assert messages == [{'sender': store['alice'], 'body': 'Hello, Bob!'},
-                            {'sender': store['bob'], 'body': 'Hey, Alice'}, {'sender': store['alice'], 'body': 'hi me'}]
+        utils.assert_results_equal([{'sender': store['alice'], 'body': 'Hello, Bob!', 'seq': 1, 'encoding': ''},
+                                    {'sender': store['bob'], 'body': 'Hey, Alice', 'seq': 2, 'encoding': ''},
+                                    {'sender': store['alice'], 'body': 'hi me', 'seq': 3, 'encoding': ''}], messages)
 
     def test_bob_gets_no_messages(self, chat, room, store):
         """Bob, having been removed, cannot see new messages."""
         messages = chat('bob').get_messages(room_channel=room)
-        utils.scrub_ids_and_timestamps(messages)
-        assert messages == [{'sender': store['alice'], 'body': 'Hello, Bob!'},
-                            {'sender': store['bob'], 'body': 'Hey, Alice'}]
+        utils.assert_results_equal([{'sender': store['alice'], 'body': 'Hello, Bob!', 'seq': 1, 'encoding': ''},
+                                    {'sender': store['bob'], 'body': 'Hey, Alice', 'seq': 2, 'encoding': ''}], messages)
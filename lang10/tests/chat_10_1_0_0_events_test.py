@@ -4,60 +4,131 @@ Event-system test for Chat 1.0.0.
 
 import pytest
 
+from utils.chat_10_1_0_0_events import EventSubscription
+
 ROOM_NAME = 'room'
 
 
 def _is_room_event_present(events, room_name, event_type):
     def is_room_event_match(event):
-        return event['type'] == ('chat/10-1.0.0/' + event_type) and event['data']['room']['name'] == room_name
+        return event['data']['room']['name'] == room_name
+
+    try:
+        events.wait_for(event_type, predicate=is_room_event_match)
+        return True
+    except TimeoutError:
+        return False
+
+
+class RecordingNode:
+    """A node whose event log is a list, counting the events each read returns."""
+
+    def __init__(self, events):
+        self.log = list(events)
+        self.returned = 0
+
+    def events(self, since=0):
+        events = self.log[since:]
+        self.returned += len(events)
+        return events
 
-    return any([is_room_event_match(event) for event in events])
 
-def get_events(network, chat_10, name):
-    return network.__getitem__(chat_10(name).key_alias).events()
+def _event(event_type, room_channel='RID-1'):
+    return {'type': f'chat/10-1.0.0/{event_type}', 'data': {'room': {'channel': room_channel}}}
+
+
+@pytest.fixture(scope="function")
+def alice_events(network, chat_10):
+    return EventSubscription(network[chat_10('alice').key_alias])
+
 
 @pytest.mark.usefixtures('network', 'store', 'chat_10')
 class TestChatCoverage():
-    def test_create_room(self, chat_10, network):
+    def test_create_room(self, chat_10, alice_events):
         chat_10('alice').create_room(room_name=ROOM_NAME)
-        assert _is_room_event_present(get_events(network, chat_10, 'alice'), ROOM_NAME, 'CreateRoomEvent')
+        assert _is_room_event_present(alice_events, ROOM_NAME, 'CreateRoomEvent')
 
-    def test_delete_room(self, chat_10, network):
+    def test_delete_room(self, chat_10, alice_events):
         room = chat_10('alice').create_room(room_name=ROOM_NAME)['room']['channel']
         chat_10('alice').delete_room(room_channel=room)
-        assert _is_room_event_present(get_events(network, chat_10, 'alice'), ROOM_NAME, 'DeleteRoomEvent')
+        assert _is_room_event_present(alice_events, ROOM_NAME, 'DeleteRoomEvent')
 
-    def test_restore_room(self, chat_10, network):
+    def test_restore_room(self, chat_10, alice_events):
         room = chat_10('alice').create_room(room_name=ROOM_NAME)['room']['channel']
         chat_10('alice').delete_room(room_channel=room)
         chat_10('alice').restore_room(room_channel=room)
-        assert _is_room_event_present(get_events(network, chat_10, 'alice'), ROOM_NAME, 'RestoreRoomEvent')
+        assert _is_room_event_present(alice_events, ROOM_NAME, 'RestoreRoomEvent')
 
-    def test_invite_to_room(self, chat_10, network, store):
+    def test_invite_to_room(self, chat_10, alice_events, store):
         room = chat_10('alice').create_room(room_name=ROOM_NAME)['room']['channel']
         chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
-        assert _is_room_event_present(get_events(network, chat_10, 'alice'), ROOM_NAME, 'InviteToRoomEvent')
+        assert _is_room_event_present(alice_events, ROOM_NAME, 'InviteToRoomEvent')
 
-    def test_remove_from_room(self, chat_10, network, store):
+    def test_remove_from_room(self, chat_10, alice_events, store):
         room = chat_10('alice').create_room(room_name=ROOM_NAME)['room']['channel']
         chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
         chat_10('alice').remove_from_room(room_channel=room, member_to_remove=store['bob'])
-        assert _is_room_event_present(get_events(network, chat_10, 'alice'), ROOM_NAME, 'RemoveFromRoomEvent')
+        assert _is_room_event_present(alice_events, ROOM_NAME, 'RemoveFromRoomEvent')
 
-    def test_send_message(self, chat_10, network):
+    def test_send_message(self, chat_10, alice_events):
         room = chat_10('alice').create_room(room_name=ROOM_NAME)['room']['channel']
         chat_10('alice').send_message(room_channel=room, message="message")
-        assert _is_room_event_present(get_events(network, chat_10, 'alice'), ROOM_NAME, 'SendMessageEvent')
+        assert _is_room_event_present(alice_events, ROOM_NAME, 'SendMessageEvent')
+
+    def test_promote_owner(self, chat_10, alice_events, store):
+        room = chat_10('alice').create_room(room_name=ROOM_NAME)['room']['channel']
+        chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
+        chat_10('alice').promote_to_owner(room_channel=room, member=store['bob'])
+        assert _is_room_event_present(alice_events, ROOM_NAME, 'PromoteToOwnerEvent')
 
-    def test_promote_owner(self, chat_10, network, store):
+    def test_demote_owner(self, chat_10, alice_events, store):
         room = chat_10('alice').create_room(room_name=ROOM_NAME)['room']['channel']
         chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
         chat_10('alice').promote_to_owner(room_channel=room, member=store['bob'])
-        assert _is_room_event_present(get_events(network, chat_10, 'alice'), ROOM_NAME, 'PromoteToOwnerEvent')
-    
-    def test_demote_owner(self, chat_10, network, store):
+        chat_10('alice').demote_owner(room_channel=room, owner=store['bob'])
+        assert _is_room_event_present(alice_events, ROOM_NAME, 'DemoteOwnerEvent')
+
+    def test_subscription_only_returns_new_events(self, chat_10, alice_events):
+        room = chat_10('alice').create_room(room_name=ROOM_NAME)['room']['channel']
+        created = alice_events.poll()
+        assert [event['type'] for event in created] == ['chat/10-1.0.0/CreateRoomEvent']
+        chat_10('alice').send_message(room_channel=room, message="message")
+        messages = EventSubscription(alice_events.node, since=alice_events.since, event_types=['SendMessageEvent'],
+                                     room_channel=room)
+        assert len(messages.wait_for()['data']['message_id']) > 0
+        assert messages.poll() == []
+
+    def test_membership_deltas(self, chat_10, alice_events, store):
+        """Every membership change also emits a compact delta, numbered by the room version it produces."""
         room = chat_10('alice').create_room(room_name=ROOM_NAME)['room']['channel']
         chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
         chat_10('alice').promote_to_owner(room_channel=room, member=store['bob'])
         chat_10('alice').demote_owner(room_channel=room, owner=store['bob'])
-        assert _is_room_event_present(get_events(network, chat_10, 'alice'), ROOM_NAME, 'DemoteOwnerEvent')
\ No newline at end of file
+        chat_10('alice').remove_from_room(room_channel=room, member_to_remove=store['bob'])
+        deltas = [alice_events.wait_for('MembershipDeltaEvent')['data'] for _ in range(4)]
+        assert [(d['room_version'], d['action'], d['member']) for d in deltas] == [
+            (1, 'invite', store['bob']), (2, 'promote', store['bob']), (3, 'demote', store['bob']),
+            (4, 'remove', store['bob'])
+        ]
+        assert all(d['room_channel'] == room and d['actor'] == store['alice'] for d in deltas)
+
+
+class TestEventSubscriptionReads():
+    def test_poll_reads_only_new_events(self):
+        node = RecordingNode(_event('SendMessageEvent') for _ in range(10000))
+        events = EventSubscription(node)
+        node.returned = 0
+        assert events.poll() == []
+        node.log += [_event('CreateRoomEvent'), _event('SendMessageEvent')]
+        assert [event['type'] for event in events.poll()] == ['chat/10-1.0.0/CreateRoomEvent',
+                                                              'chat/10-1.0.0/SendMessageEvent']
+        assert node.returned == 2
+        assert events.since == 10002
+
+    def test_wait_for_leaves_the_cursor_after_the_match(self):
+        node = RecordingNode([])
+        events = EventSubscription(node)
+        node.log += [_event('CreateRoomEvent'), _event('SendMessageEvent'), _event('DeleteRoomEvent')]
+        assert events.wait_for('SendMessageEvent')['type'] == 'chat/10-1.0.0/SendMessageEvent'
+        assert events.since == 2
+        assert [event['type'] for event in events.poll()] == ['chat/10-1.0.0/DeleteRoomEvent']
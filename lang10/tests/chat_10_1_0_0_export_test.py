@@ -0,0 +1,96 @@
+"""
+Tests for the streaming room export.
+"""
+
+import json
+
+import msgpack
+import pytest
+
+from utils.chat_10_1_0_0_export import ARCHIVE_PAGE_SIZE, MSGPACK, NDJSON, RoomExporter, export_rooms
+
+
+class _RoomHistory:
+    """The paging reads of a room with `count` messages, the first `archived_count` of them archived."""
+
+    def __init__(self, count, archived_count=0):
+        self.messages = [{'seq': seq, 'body': f'message {seq}', 'encoding': ''} for seq in range(1, count + 1)]
+        self.archived_count = archived_count
+        self.reads = 0
+
+    def get_messages_after(self, room_channel, after_seq, limit):
+        self.reads += 1
+        start = max(after_seq, self.archived_count)
+        return self.messages[start:start + limit]
+
+    def get_archived_messages(self, room_channel, page):
+        self.reads += 1
+        start = page * ARCHIVE_PAGE_SIZE
+        return self.messages[start:min(start + ARCHIVE_PAGE_SIZE, self.archived_count)]
+
+
+def _ndjson_seqs(path):
+    with open(path) as f:
+        return [json.loads(line)['seq'] for line in f]
+
+
+class TestRoomExport():
+    def test_export_in_pages(self, tmp_path):
+        room = _RoomHistory(25)
+        path = tmp_path / 'room.ndjson'
+        assert RoomExporter(room, page_size=10).export_room('room', str(path)) == 25
+        assert _ndjson_seqs(path) == list(range(1, 26))
+        assert room.reads == 4
+
+    def test_export_includes_archive(self, tmp_path):
+        room = _RoomHistory(250, archived_count=230)
+        path = tmp_path / 'room.ndjson'
+        assert RoomExporter(room, page_size=50).export_room('room', str(path)) == 250
+        assert _ndjson_seqs(path) == list(range(1, 251))
+
+    def test_resume_after_partial_line(self, tmp_path):
+        room = _RoomHistory(30)
+        path = tmp_path / 'room.ndjson'
+        RoomExporter(_RoomHistory(12), page_size=5).export_room('room', str(path))
+        with open(path, 'ab') as f:
+            f.write(b'{"seq": 13, "bo')
+        assert RoomExporter(room, page_size=5).export_room('room', str(path)) == 18
+        assert _ndjson_seqs(path) == list(range(1, 31))
+
+    def test_resume_msgpack(self, tmp_path):
+        path = tmp_path / 'room.msgpack'
+        RoomExporter(_RoomHistory(7)).export_room('room', str(path), MSGPACK)
+        with open(path, 'ab') as f:
+            f.write(msgpack.packb({'seq': 8, 'body': 'message 8'})[:-3])
+        assert RoomExporter(_RoomHistory(9)).export_room('room', str(path), MSGPACK) == 2
+        with open(path, 'rb') as f:
+            assert [message['seq'] for message in msgpack.Unpacker(f, raw=False)] == list(range(1, 10))
+
+    def test_unknown_format(self, tmp_path):
+        with pytest.raises(ValueError):
+            RoomExporter(_RoomHistory(1)).export_room('room', str(tmp_path / 'room.csv'), 'csv')
+
+    def test_export_rooms_in_parallel(self, tmp_path):
+        rooms = {f'room-{i}': _RoomHistory(10 * i) for i in range(1, 6)}
+
+        class _Rooms:
+            def __getattr__(self, method):
+                return lambda room_channel, **kwargs: getattr(rooms[room_channel], method)(room_channel, **kwargs)
+
+        counts = export_rooms(_Rooms(), list(rooms), str(tmp_path), max_workers=2, page_size=7)
+        assert counts == {room_channel: len(room.messages) for room_channel, room in rooms.items()}
+        assert _ndjson_seqs(tmp_path / 'room-5.ndjson') == list(range(1, 51))
+
+
+@pytest.mark.usefixtures('network', 'store', 'chat_10')
+class TestRoomExportNetwork():
+    def test_export_room(self, tmp_path, chat_10):
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        for i in range(5):
+            chat_10('alice').send_message(room_channel=room, message=f'message {i}')
+        path = tmp_path / 'room.ndjson'
+        assert RoomExporter(chat_10('alice'), page_size=2).export_room(room, str(path), NDJSON) == 5
+        chat_10('alice').send_message(room_channel=room, message='message 5')
+        assert RoomExporter(chat_10('alice'), page_size=2).export_room(room, str(path), NDJSON) == 1
+        with open(path) as f:
+            assert [json.loads(line)['body'] for line in f] == [f'message {i}' for i in range(6)]
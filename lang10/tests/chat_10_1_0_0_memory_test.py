@@ -0,0 +1,86 @@
+"""
+Tests for the memory reporting and room eviction of the Chat model.
+"""
+
+import tracemalloc
+
+import pytest
+
+from model.chat_10_1_0_0_model import ChatModel
+from utils.chat_10_1_0_0_memory import STRUCTURES, MemoryTracker, structure_sizes
+
+
+def _run(model, run, rooms=3, messages=20):
+    """Builds the rooms of a run, each with two members and `messages` messages."""
+    creator, member = f'{run}-creator', f'{run}-member'
+    for i in range(rooms):
+        room_channel = f'{run}-room-{i}'
+        model.create_room(creator, room_channel, f'room {i}')
+        model.invite_to_room(creator, room_channel, member)
+        model.send_messages(member, room_channel, [f'message {n} of {room_channel}' for n in range(messages)])
+    return creator, member
+
+
+class TestMemory():
+    def test_evict_rooms(self):
+        model = ChatModel()
+        old = _run(model, 'old')
+        new = _run(model, 'new')
+        model.delete_room('old-creator', 'old-room-0')
+        digest = model.get_room_digest('old-member', 'old-room-1')
+
+        assert model.evict_rooms(old) == 3
+        assert model.rooms['old-room-1'].digest == digest
+        assert model.deleted_rooms == set()
+        with pytest.raises(AssertionError):
+            model.get_messages('old-member', 'old-room-1')
+        # the rooms of the other run are untouched
+        assert len(model.get_rooms(new[0])) == 3
+        assert len(model.get_messages(new[1], 'new-room-2')) == 20
+
+    def test_eviction_keeps_memory_flat(self):
+        model = ChatModel()
+        sizes = []
+        for run in range(5):
+            model.evict_rooms(_run(model, f'run-{run}', messages=50))
+            sizes.append(structure_sizes(model))
+        assert sizes[-1]['messages'] == sizes[0]['messages']
+        assert sizes[-1]['index'] == sizes[0]['index']
+
+    def test_structure_sizes(self):
+        model = ChatModel()
+        empty = structure_sizes(model)
+        _run(model, 'run')
+        sizes = structure_sizes(model)
+        assert set(sizes) == set(STRUCTURES)
+        assert all(sizes[name] > empty[name] for name in STRUCTURES)
+        assert sizes['messages'] > sizes['members']
+
+    def test_tracker_report(self):
+        model = ChatModel()
+        tracker = MemoryTracker()
+        try:
+            tracker.sample(model)
+            _run(model, 'run')
+            sample = tracker.sample(model)
+            assert sample['room_count'] == 3
+        finally:
+            tracker.stop()
+        # the report is taken from the samples, so it's still there once tracing is off
+        assert not tracemalloc.is_tracing()
+        report = tracker.report(top=2).splitlines()
+        assert report[0] == 'memory over 2 samples'
+        assert 'size=' in report[-1]
+
+    def test_tracker_stops_per_run(self):
+        model = ChatModel()
+        tracker = MemoryTracker()
+        for run in range(3):
+            if run:
+                tracker.start()
+            assert tracemalloc.is_tracing()
+            _run(model, f'run-{run}')
+            tracker.sample(model)
+            tracker.stop()
+            assert not tracemalloc.is_tracing()
+        assert len(tracker.samples) == 3
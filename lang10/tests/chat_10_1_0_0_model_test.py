@@ -1,7 +1,9 @@
 import pytest
 
 from hypothesis import settings
-from chat_10_1_0_0_state_machine import ChatValidator
+import chat_10_1_0_0_state_machine as state_machine
+from chat_10_1_0_0_state_machine import (COVERAGE, BoundedChatValidator, CachedChatValidator, ChatValidator,
+                                         ScaleChatValidator)
 from assembly_client.api.contracts import ContractRef
 
 settings_profile = 'chat_model_test'
@@ -72,6 +74,13 @@ class TestRegTests:
         room = state.create_room(creator=creator, room_name='room_name')
         state.get_messages(getter=creator, room_channel=room)
 
+    def test_send_messages(self, state):
+        sender = state.key_alias()
+        room = state.create_room(creator=sender, room_name='room_name')
+        events = state.send_messages(sender=sender, room_channel=room, messages=['one', 'two'])
+        assert [m.message_id for m in state.model.rooms[room].messages] == [e['message_id'] for e in events]
+        state.get_messages(getter=sender, room_channel=room)
+
     def test_get_messages_as_non_member(self, state):
         non_member = state.key_alias()
         creator = state.key_alias()
@@ -97,6 +106,14 @@ class TestRegTests:
         state.promote_to_owner(promoter=u1, promotee=u2, room_channel=room)
         state.remove_from_room(remover=u2, removee=u1, room_channel=room)
 
+    def test_send_after_removal(self, state):
+        u = [state.key_alias() for _ in range(3)]
+        room = state.create_room(creator=u[0], room_name="rm1")
+        state.invite_to_room(inviter=u[0], room_channel=room, invitee=u[1])
+        state.invite_to_room(inviter=u[0], room_channel=room, invitee=u[2])
+        state.send_message(message='before', room_channel=room, sender=u[1])
+        state.send_after_removal(room_channel=room, removee=u[2], message='after')
+
     def test_send_message_as_non_member(self, state):
         sender = state.key_alias()
         creator = state.key_alias()
@@ -287,6 +304,48 @@ class TestRegTests:
         state.promote_to_owner(promoter=u[0], room_channel=room, promotee=u[1])
         state.demote_owner(demoter=u[2], room_channel=room, demotee=u[0])
 
+
+@pytest.mark.usefixtures('network', 'store', 'state')
+class TestScaleRegTests:
+    @pytest.fixture(scope="function")
+    def state(self, network):
+        state = ScaleChatValidator(network, is_regression_test=True)
+        yield state
+        state.teardown()
+
+    def test_network_setup(self, network):
+        set_up_network(network)
+
+    def test_grow_members(self, state):
+        u1 = state.key_alias()
+        room = state.create_room(creator=u1, room_name='rm1')
+        invitees = state.grow_members(room_channel=room, count=5).values
+        assert len(state.model.rooms[room].members) == 6
+        state.get_rooms(getter=invitees[-1])
+
+    def test_grow_messages(self, state):
+        u1 = state.key_alias()
+        room = state.create_room(creator=u1, room_name='rm1')
+        state.grow_messages(room_channel=room, batches=2, words=['alpha', 'beta'])
+        assert state.model.rooms[room].message_count == 2 * 50
+        state.get_messages(getter=u1, room_channel=room)
+
+    def test_grow_owners_and_churn(self, state):
+        u1 = state.key_alias()
+        room = state.create_room(creator=u1, room_name='rm1')
+        state.grow_members(room_channel=room, count=3)
+        state.grow_owners(room_channel=room, count=2)
+        assert len(state.model.rooms[room].owners) == 3
+        state.churn_room(room_channel=room)
+        state.churn_room(room_channel=room)
+        assert state.model.rooms[room].restore_count == 2
+
+    def test_grow_rooms(self, state):
+        u1 = state.key_alias()
+        state.grow_rooms(creator=u1, count=4)
+        state.get_room_summaries(getter=u1)
+
+
 @pytest.mark.usefixtures('network')
 @pytest.mark.proptest
 class TestPropertyTests:
@@ -295,3 +354,14 @@ class TestPropertyTests:
 
     def test_chat_model(network, model_tester, hypothesis_settings):
         model_tester.run(ChatValidator, hypothesis_settings)
+
+    def test_chat_model_cached(network, model_tester, hypothesis_settings):
+        model_tester.run(CachedChatValidator, hypothesis_settings)
+
+    def test_chat_model_at_scale(network, model_tester, hypothesis_settings):
+        model_tester.run(ScaleChatValidator, hypothesis_settings)
+        print(COVERAGE.report())
+
+    def test_chat_model_bounded(network, model_tester, hypothesis_settings):
+        model_tester.run(BoundedChatValidator, hypothesis_settings)
+        print(state_machine.MEMORY.report())
@@ -0,0 +1,31 @@
+"""
+Tests for the scale goals and state coverage of the model validator.
+"""
+
+from utils.chat_10_1_0_0_scale import StateCoverage, region_of
+
+
+class TestStateCoverage():
+    def test_region_of(self):
+        assert [region_of(size) for size in (0, 1, 9, 10, 99, 100, 999, 1000, 50000)] == [
+            '0', '1-9', '1-9', '10-99', '10-99', '100-999', '100-999', '1000+', '1000+'
+        ]
+
+    def test_record(self):
+        coverage = StateCoverage(goals={'members_per_room': 200, 'messages_per_room': 2000})
+        coverage.record({'members_per_room': 3, 'messages_per_room': 0})
+        coverage.record({'members_per_room': 250, 'messages_per_room': 40})
+        coverage.record({'members_per_room': 7, 'messages_per_room': 1200})
+        assert coverage.runs == 3
+        assert coverage.regions['members_per_room'] == {'1-9': 2, '100-999': 1}
+        assert coverage.reached('members_per_room')
+        assert not coverage.reached('messages_per_room')
+
+    def test_report(self):
+        coverage = StateCoverage(goals={'rooms_per_alias': 20})
+        for size in (150, 2, 0, 30):
+            coverage.record({'rooms_per_alias': size})
+        assert coverage.report().splitlines() == [
+            'state coverage over 4 runs',
+            '  rooms_per_alias [0: 1, 1-9: 1, 10-99: 1, 100-999: 1] largest 150, goal 20 reached',
+        ]
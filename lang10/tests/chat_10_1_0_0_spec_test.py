@@ -4,9 +4,11 @@ Specifications for the Chat 1.0.0 contract.
 
 import pytest
 import time
-
+from concurrent.futures import ThreadPoolExecutor
 
 import utils.chat_10_1_0_0_test_utils as utils
+from utils.chat_10_1_0_0_codec import CompressingChatClient
+from utils.chat_10_1_0_0_events import EventSubscription
 
 # Chat messages are up to 4000 Unicode characters long (the same limitation used by Slack).
 MESSAGE_LENGTH = 4000
@@ -17,6 +19,9 @@ MESSAGES_PER_ROOM = 2500
 # One to ten users per room are supported.
 USERS_PER_ROOM = 10
 
+# the most messages send_messages accepts at once, the API's send queue coalesces up to this many
+MAX_SEND_BATCH = 50
+
 
 @pytest.mark.usefixtures('network', 'store', 'chat_10')
 @pytest.mark.proptest  # as of 2018-04-30 this takes about ten minutes on a real network, which is a bit too long
@@ -35,3 +40,74 @@ class TestChatStress():
         chat_10('alice').get_messages(room_channel=room)
         end = time.time()
         print("Retrieval latency: {0:.2f}ms".format((end - start) * 1000))
+
+    def test_compressed_storage_benchmark(self, chat_10):
+        """Compares storage and retrieval latency of full-length messages, stored as-is and compressed."""
+        message = ' '.join(f"word{i}" for i in range(MESSAGE_LENGTH))[:MESSAGE_LENGTH]
+        compressing_chat = CompressingChatClient(chat_10('alice'))
+        for name, chat in [('plain', chat_10('alice')), ('compressed', compressing_chat)]:
+            room = chat_10('alice').create_room(room_name=name)['room']['channel']
+            for i in range(MESSAGES_PER_ROOM):
+                print(f"Sending {name} message {i}...")
+                chat.send_message(room_channel=room, message=message)
+            start = time.time()
+            messages = chat.get_messages(room_channel=room)
+            end = time.time()
+            assert len(messages) == MESSAGES_PER_ROOM
+            assert all(m['body'] == message for m in messages)
+            stored_bytes = sum(len(m['body'].encode('utf-8')) for m in chat_10('alice').get_messages(room_channel=room))
+            print("{0}: stored {1} bytes, retrieval latency {2:.2f}ms".format(name, stored_bytes, (end - start) * 1000))
+        print(f"codec: {compressing_chat.codec.stats()}")
+
+    def test_send_throughput(self, chat_10, store):
+        """Compares sustained message throughput of a burst from two senders to one room, with every message in its own
+        transaction and with each sender's messages coalesced into send_messages batches, as the API's send queue
+        does."""
+        senders = ['alice', 'bob']
+        messages_per_sender = 500
+        for coalesce in [False, True]:
+            room = chat_10('alice').create_room(room_name=f'coalesce={coalesce}')['room']['channel']
+            chat_10('alice').invite_to_room(room_channel=room, new_member=store['bob'])
+
+            def send_all(sender):
+                messages = [f"{sender} {i}" for i in range(messages_per_sender)]
+                if coalesce:
+                    for i in range(0, len(messages), MAX_SEND_BATCH):
+                        chat_10(sender).send_messages(room_channel=room, messages=messages[i:i + MAX_SEND_BATCH])
+                else:
+                    for message in messages:
+                        chat_10(sender).send_message(room_channel=room, message=message)
+
+            start = time.time()
+            with ThreadPoolExecutor(max_workers=len(senders)) as pool:
+                list(pool.map(send_all, senders))
+            end = time.time()
+            messages = chat_10('alice').get_messages(room_channel=room)
+            assert len(messages) == len(senders) * messages_per_sender
+            assert utils.find_sequence_gaps(messages) == []
+            print("coalesce={0}: {1:.1f} messages/s".format(coalesce, len(messages) / (end - start)))
+
+    def test_message_fetch_latency(self, chat_10, store, network):
+        """Measures the end-to-end latency of delivering a message to every member of a room, when each member waits
+        for its SendMessageEvent and then fetches just that message with get_message."""
+        room = chat_10('alice').create_room(room_name='room')['room']['channel']
+        members = [store['alice']]
+        for i in range(USERS_PER_ROOM - 1):
+            store[f"user_{i}"] = network.register_key_alias()
+            chat_10('alice').invite_to_room(room_channel=room, new_member=store[f"user_{i}"])
+            members.append(store[f"user_{i}"])
+        subscriptions = {
+            member: EventSubscription(network[member], event_types={'SendMessageEvent'}, room_channel=room)
+            for member in members
+        }
+        latencies = []
+        for i in range(20):
+            start = time.time()
+            chat_10('alice').send_message(room_channel=room, message=f"message {i}")
+            for member, subscription in subscriptions.items():
+                message_id = subscription.wait_for('SendMessageEvent')['data']['message_id']
+                message = network[member].chat["10-1.0.0"].get_message(room_channel=room, message_id=message_id)
+                assert message['body'] == f"message {i}"
+            latencies.append(time.time() - start)
+        latencies.sort()
+        print("median {0:.2f}ms, max {1:.2f}ms".format(latencies[len(latencies) // 2] * 1000, latencies[-1] * 1000))
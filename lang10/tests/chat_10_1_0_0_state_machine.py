@@ -1,27 +1,41 @@
-from string import printable
+from string import ascii_lowercase, printable
 
 from hypothesis import note
 from hypothesis import assume
-from hypothesis.stateful import Bundle, RuleBasedStateMachine, rule
+from hypothesis import target
+from hypothesis.stateful import Bundle, RuleBasedStateMachine, initialize, multiple, precondition, rule
 import hypothesis.strategies as st
 
 from assembly_client.api.types.error_types import ContractError
 
 import model.chat_10_1_0_0_model as model
 
-from utils.chat_10_1_0_0_test_utils import scrub_ids_and_timestamps
+from utils.chat_10_1_0_0_cache import CachingChatClient
+from utils.chat_10_1_0_0_events import EventSubscription
+from utils.chat_10_1_0_0_memory import MemoryTracker
+from utils.chat_10_1_0_0_scale import SCALE_GOALS, StateCoverage, measure
+from utils.chat_10_1_0_0_test_utils import assert_results_equal
 
 # global, non-resetting model
 MODEL = None
 
+# global memory samples of `MODEL`, taken at the end of each bounded run
+MEMORY = None
+
 # constant representing fatal termination states in the state machine
 FATAL_ERROR = None
 
 CHAT_VERSION = "10-1.0.0"
 
+# the bulk rules of `ScaleChatValidator`, each run enables a random subset of them
+GROW_RULES = ('grow_members', 'grow_messages', 'grow_owners', 'grow_rooms', 'churn_room')
+
+# global, non-resetting record of the state space regions reached by `ScaleChatValidator` runs
+COVERAGE = StateCoverage()
+
 
 class ChatValidator(RuleBasedStateMachine):
-    def __init__(self, network, is_regression_test=False):
+    def __init__(self, network, is_regression_test=False, use_cache=False, bounded=False):
         super(ChatValidator, self).__init__()
 
         # use a module-global `MODEL` variable to mimic a non-resetting network
@@ -33,6 +47,26 @@ class ChatValidator(RuleBasedStateMachine):
         self.network = network  # note, no network reset here; this makes things faster
         self.is_regression_test = is_regression_test
 
+        # when set, reads go through validating read-through caches, which checks the cache invalidation rules
+        self.use_cache = use_cache
+        self.caches = {}
+
+        # the key aliases registered in this run
+        self.run_key_aliases = set()
+
+        # the MembershipDeltaEvents seen by each key alias registered in this run
+        self.membership_deltas = {}
+
+        # when set, the rooms of this run are evicted from the model at teardown, which keeps long runs flat on memory,
+        # and memory is traced for the length of the run
+        self.bounded = bounded
+        if bounded:
+            global MEMORY
+            if MEMORY is None:
+                MEMORY = MemoryTracker()
+            else:
+                MEMORY.start()
+
     key_aliases = Bundle('key_aliases')
     room_channels = Bundle('room_channels')
 
@@ -42,6 +76,13 @@ class ChatValidator(RuleBasedStateMachine):
         else:
             print(s)
 
+    def chat(self, caller):
+        if not self.use_cache:
+            return self.network[caller].chat[CHAT_VERSION]
+        if caller not in self.caches:
+            self.caches[caller] = CachingChatClient(self.network[caller], CHAT_VERSION, validate=True)
+        return self.caches[caller]
+
     def try_and_catch(self, act):
         try:
             return act()
@@ -51,21 +92,58 @@ class ChatValidator(RuleBasedStateMachine):
 
     def assert_results_match(self, method, caller, **kwargs):
         """Calls the method on both the network and the model, and ensures that their return values are the same."""
-        network_result = self.try_and_catch(lambda: getattr(self.network[caller].chat[CHAT_VERSION], method)(**kwargs))
+        network_result = self.try_and_catch(lambda: getattr(self.chat(caller), method)(**kwargs))
         model_result = self.try_and_catch(lambda: getattr(self.model, method)(caller, **kwargs))
-        if isinstance(model_result, (list, )) and len(model_result) > 0 and 'message_id' in model_result[0]:
-            assert scrub_ids_and_timestamps(model_result) == scrub_ids_and_timestamps(network_result)
-        else:
-            assert model_result == network_result
+        # message ids and timestamps are generated by the network, so the model cannot predict them
+        assert_results_equal(model_result, network_result)
         return network_result
 
+    def assert_room_digest_matches(self, getter, room_channel):
+        """Compares a room by its digest, which is O(1). The full state is only compared when the digests disagree."""
+        network_result = self.try_and_catch(lambda: self.chat(getter).get_room_digest(room_channel=room_channel))
+        model_result = self.try_and_catch(lambda: self.model.get_room_digest(getter, room_channel))
+        if model_result != network_result:
+            # diff the full state, to report which message or member diverged
+            self.assert_results_match('get_messages', getter, room_channel=room_channel)
+            self.assert_results_match('get_rooms', getter)
+        assert model_result == network_result
+        return network_result
+
+    def assert_membership_change_matches(self, method, caller, room_channel, **kwargs):
+        """Like `assert_results_match`, and also checks that the network emitted the same MembershipDeltaEvents as the
+        model for the change."""
+        room = self.model.rooms.get(room_channel)
+        version_before = room.version if room is not None else 0
+        result = self.assert_results_match(method, caller, room_channel=room_channel, **kwargs)
+        if room is not None and caller in self.membership_deltas:
+            for delta in room.deltas[version_before:]:
+                event = self.membership_deltas[caller].wait_for(
+                    predicate=lambda e: e['data']['room_channel'] == room_channel and e['data']['room_version'] ==
+                    delta.room_version)
+                assert_results_equal(delta.as_data(), event['data'])
+        return result
+
+    def teardown(self):
+        if self.bounded:
+            try:
+                # bundles don't outlive a run, so no later run can reach this run's key aliases or the rooms they are in
+                evicted = self.model.evict_rooms(self.run_key_aliases)
+                self.note(f"evicted {evicted} rooms, memory: {MEMORY.sample(self.model)}")
+            finally:
+                MEMORY.stop()
+        super(ChatValidator, self).teardown()
+
     # Each of these rules are changing the state of the state machine.
     # They will be randomly called by `hypothesis`, adhering to the rules provided.
 
     @rule(target=key_aliases)  # whatever this function returns, put it in `key_aliases`
     def key_alias(self):
         """Register a network identity."""
-        return self.network.register_key_alias()
+        key_alias = self.network.register_key_alias()
+        self.run_key_aliases.add(key_alias)
+        self.membership_deltas[key_alias] = EventSubscription(self.network[key_alias],
+                                                              event_types=['MembershipDeltaEvent'])
+        return key_alias
 
     # We need to pass the room_channel from the system to the model since the id generation is nondeterministic. That's
     # why this function does not simply use `assert_results_match` like all the others.
@@ -93,9 +171,9 @@ class ChatValidator(RuleBasedStateMachine):
     def send_message(self, sender, room_channel, message):
         assume(room_channel != FATAL_ERROR)
         try:
-            send_message_id = self.network[sender].chat[CHAT_VERSION].send_message(room_channel=room_channel,
+            send_message_event = self.network[sender].chat[CHAT_VERSION].send_message(room_channel=room_channel,
                                                                                       message=message)
-            message_id = send_message_id
+            message_id = send_message_event['message_id']
             self.model.send_message(sender, room_channel, message, message_id, "")
         except ContractError as network_error:
             print(f"network_result: {network_error.message}")
@@ -108,24 +186,132 @@ class ChatValidator(RuleBasedStateMachine):
                 print(f"model_result: {model_error.message}")
                 assert model_error.message == model_error.message
 
+    @rule(sender=key_aliases,
+          room_channel=room_channels,
+          message=st.text(printable),
+          encoding=st.sampled_from(['', 'zlib+base64', 'unknown']))
+    def send_encoded_message(self, sender, room_channel, message, encoding):
+        assume(room_channel != FATAL_ERROR)
+        try:
+            send_message_event = self.network[sender].chat[CHAT_VERSION].send_encoded_message(
+                room_channel=room_channel, message=message, encoding=encoding)
+            message_id = send_message_event['message_id']
+            self.model.send_message(sender, room_channel, message, message_id, "", encoding)
+        except ContractError as network_error:
+            print(f"network_result: {network_error.message}")
+            try:
+                # sending has failed on the network, so we're just checking error messages now.
+                self.model.send_message(sender, room_channel, message, None, None, encoding)
+            except ContractError as model_error:
+                print(f"model_result: {model_error.message}")
+                assert model_error.message == network_error.message
+
+    @rule(sender=key_aliases, room_channel=room_channels, messages=st.lists(st.text(printable), max_size=3))
+    def send_messages(self, sender, room_channel, messages):
+        assume(room_channel != FATAL_ERROR)
+        network_result = self.try_and_catch(
+            lambda: self.chat(sender).send_messages(room_channel=room_channel, messages=messages))
+        # message ids are generated by the network, so the model records the ones of the returned events
+        message_ids = [event['message_id'] for event in network_result] if isinstance(network_result, list) else None
+        model_result = self.try_and_catch(
+            lambda: self.model.send_messages(sender, room_channel, messages, message_ids, ""))
+        assert_results_equal(model_result, network_result)
+        return network_result
+
     @rule(room_channel=room_channels, inviter=key_aliases, invitee=key_aliases)
     def invite_to_room(self, inviter, room_channel, invitee):
         assume(room_channel != FATAL_ERROR)
-        return self.assert_results_match('invite_to_room', inviter, room_channel=room_channel, new_member=invitee)
+        return self.assert_membership_change_matches('invite_to_room',
+                                                     inviter,
+                                                     room_channel=room_channel,
+                                                     new_member=invitee)
 
     @rule(room_channel=room_channels, remover=key_aliases, removee=key_aliases)
     def remove_from_room(self, remover, room_channel, removee):
         assume(room_channel != FATAL_ERROR)
-        return self.assert_results_match('remove_from_room',
-                                         remover,
-                                         room_channel=room_channel,
-                                         member_to_remove=removee)
+        return self.assert_membership_change_matches('remove_from_room',
+                                                     remover,
+                                                     room_channel=room_channel,
+                                                     member_to_remove=removee)
 
     @rule(room_channel=room_channels, getter=key_aliases)
     def get_messages(self, room_channel, getter):
+        """Compares the full result, the digest doesn't cover which messages are archived."""
         assume(room_channel != FATAL_ERROR)
         return self.assert_results_match('get_messages', getter, room_channel=room_channel)
 
+    @rule(room_channel=room_channels, getter=key_aliases, data=st.data())
+    def get_message(self, room_channel, getter, data):
+        assume(room_channel != FATAL_ERROR)
+        room = self.model.rooms.get(room_channel)
+        message_ids = [m.message_id for m in room.messages] if room is not None else []
+        assume(message_ids)
+        message_id = data.draw(st.sampled_from(message_ids))
+        return self.assert_results_match('get_message', getter, room_channel=room_channel, message_id=message_id)
+
+    @rule(room_channel=room_channels,
+          getter=key_aliases,
+          after_seq=st.integers(min_value=0, max_value=20),
+          limit=st.integers(min_value=0, max_value=20))
+    def get_messages_after(self, room_channel, getter, after_seq, limit):
+        assume(room_channel != FATAL_ERROR)
+        return self.assert_results_match('get_messages_after',
+                                         getter,
+                                         room_channel=room_channel,
+                                         after_seq=after_seq,
+                                         limit=limit)
+
+    @rule(room_channel=room_channels, getter=key_aliases, data=st.data(), limit=st.integers(min_value=0, max_value=5))
+    def search_messages(self, room_channel, getter, data, limit):
+        assume(room_channel != FATAL_ERROR)
+        # random text rarely contains a word of the room, so most queries are built from the indexed ones
+        room = self.model.rooms.get(room_channel)
+        words = sorted(room.token_index) if room is not None else []
+        if words and data.draw(st.booleans()):
+            query = ' '.join(data.draw(st.lists(st.sampled_from(words), min_size=1, max_size=3)))
+        else:
+            query = data.draw(st.text(printable, max_size=10))
+        return self.assert_results_match('search_messages', getter, room_channel=room_channel, query=query, limit=limit)
+
+    @rule(room_channel=room_channels, caller=key_aliases, max_messages=st.integers(min_value=-1, max_value=10))
+    def set_room_retention(self, room_channel, caller, max_messages):
+        assume(room_channel != FATAL_ERROR)
+        return self.assert_results_match('set_room_retention',
+                                         caller,
+                                         room_channel=room_channel,
+                                         max_messages=max_messages)
+
+    @rule(room_channel=room_channels, removee=key_aliases, message=st.text(printable))
+    def send_after_removal(self, room_channel, removee, message):
+        """Removes a member, then has a member other than the remover send the first message after the removal, and
+        every member, the removee included, read straight afterwards."""
+        assume(room_channel != FATAL_ERROR)
+        room = self.model.rooms.get(room_channel)
+        assume(room is not None and not room.is_deleted and removee in room.members)
+        remover = next((owner for owner in room.owners if owner != removee), None)
+        assume(remover is not None)
+        sender = next((member for member in room.members if member not in (remover, removee)), None)
+        assume(sender is not None)
+        self.remove_from_room(remover=remover, room_channel=room_channel, removee=removee)
+        self.send_message(sender=sender, room_channel=room_channel, message=message)
+        for reader in list(room.members) + [removee]:
+            self.assert_results_match('get_messages', reader, room_channel=room_channel)
+
+    @rule(room_channel=room_channels, caller=key_aliases)
+    def archive_room_history(self, room_channel, caller):
+        assume(room_channel != FATAL_ERROR)
+        return self.assert_results_match('archive_room_history', caller, room_channel=room_channel)
+
+    @rule(room_channel=room_channels, getter=key_aliases, page=st.integers(min_value=-1, max_value=2))
+    def get_archived_messages(self, room_channel, getter, page):
+        assume(room_channel != FATAL_ERROR)
+        return self.assert_results_match('get_archived_messages', getter, room_channel=room_channel, page=page)
+
+    @rule(room_channel=room_channels, getter=key_aliases)
+    def get_room_digest(self, room_channel, getter):
+        assume(room_channel != FATAL_ERROR)
+        return self.assert_room_digest_matches(getter, room_channel)
+
     @rule(room_channel=room_channels, deleter=key_aliases)
     def delete_room(self, room_channel, deleter):
         assume(room_channel != FATAL_ERROR)
@@ -140,12 +326,134 @@ class ChatValidator(RuleBasedStateMachine):
     def get_rooms(self, getter):
         return self.assert_results_match('get_rooms', getter)
 
+    @rule(room_channel=room_channels, getter=key_aliases)
+    def get_room(self, room_channel, getter):
+        assume(room_channel != FATAL_ERROR)
+        return self.assert_results_match('get_room', getter, room_channel=room_channel)
+
+    @rule(getter=key_aliases)
+    def get_deleted_rooms(self, getter):
+        return self.assert_results_match('get_deleted_rooms', getter)
+
+    @rule(getter=key_aliases)
+    def get_room_summaries(self, getter):
+        return self.assert_results_match('get_room_summaries', getter)
+
     @rule(room_channel=room_channels, promoter=key_aliases, promotee=key_aliases)
     def promote_to_owner(self, promoter, room_channel, promotee):
         assume(room_channel != FATAL_ERROR)
-        return self.assert_results_match('promote_to_owner', promoter, room_channel=room_channel, member=promotee)
+        return self.assert_membership_change_matches('promote_to_owner',
+                                                     promoter,
+                                                     room_channel=room_channel,
+                                                     member=promotee)
 
     @rule(room_channel=room_channels, demoter=key_aliases, demotee=key_aliases)
     def demote_owner(self, demoter, room_channel, demotee):
         assume(room_channel != FATAL_ERROR)
-        return self.assert_results_match('demote_owner', demoter, room_channel=room_channel, owner=demotee)
\ No newline at end of file
+        return self.assert_membership_change_matches('demote_owner', demoter, room_channel=room_channel, owner=demotee)
+
+
+class CachedChatValidator(ChatValidator):
+    """Runs the same rules with every read going through a validating `CachingChatClient`."""
+
+    def __init__(self, network, is_regression_test=False):
+        super(CachedChatValidator, self).__init__(network, is_regression_test, use_cache=True)
+
+
+class BoundedChatValidator(ChatValidator):
+    """Runs the same rules, evicting each run's rooms from the model at teardown, for long soak runs."""
+
+    def __init__(self, network, is_regression_test=False):
+        super(BoundedChatValidator, self).__init__(network, is_regression_test, bounded=True)
+
+
+class ScaleChatValidator(ChatValidator):
+    """Runs the same rules plus bulk "grow" rules, which build rooms of the sizes in `SCALE_GOALS`.
+
+    Each run enables a random subset of the grow rules (swarm testing), so some runs push one dimension far instead of
+    every dimension a little. At the end of a run, `target` reports how close its rooms came to each goal, which steers
+    hypothesis towards the larger states, and the regions they reached are recorded in `COVERAGE`.
+    """
+
+    def __init__(self, network, is_regression_test=False, goals=None, bounded=False):
+        super(ScaleChatValidator, self).__init__(network, is_regression_test, bounded=bounded)
+        self.goals = dict(SCALE_GOALS if goals is None else goals)
+        self.enabled = set(GROW_RULES)
+
+    @initialize(enabled=st.sets(st.sampled_from(GROW_RULES), min_size=1))
+    def enable_grow_rules(self, enabled):
+        self.note(f"grow rules: {sorted(enabled)}")
+        self.enabled = enabled
+
+    def growable_room(self, room_channel):
+        assume(room_channel != FATAL_ERROR)
+        room = self.model.rooms.get(room_channel)
+        assume(room is not None and not room.is_deleted)
+        return room
+
+    @precondition(lambda self: 'grow_members' in self.enabled)
+    @rule(target=ChatValidator.key_aliases,
+          room_channel=ChatValidator.room_channels,
+          count=st.integers(min_value=1, max_value=50))
+    def grow_members(self, room_channel, count):
+        """Registers `count` network identities and invites them all to the room."""
+        room = self.growable_room(room_channel)
+        inviter = room.owners[0]
+        invitees = [self.key_alias() for _ in range(count)]
+        for invitee in invitees:
+            self.invite_to_room(inviter=inviter, room_channel=room_channel, invitee=invitee)
+        return multiple(*invitees)
+
+    @precondition(lambda self: 'grow_messages' in self.enabled)
+    @rule(room_channel=ChatValidator.room_channels,
+          batches=st.integers(min_value=1, max_value=10),
+          words=st.lists(st.text(ascii_lowercase, min_size=1, max_size=8), min_size=1, max_size=5))
+    def grow_messages(self, room_channel, batches, words):
+        """Sends `batches` full batches of messages to the room, from each member in turn. The bodies repeat `words`,
+        which gives `search_messages` long postings to intersect."""
+        room = self.growable_room(room_channel)
+        for batch in range(batches):
+            sender = room.members[batch % len(room.members)]
+            messages = [f'{words[i % len(words)]} {room.message_count + i}' for i in range(model.MAX_SEND_BATCH)]
+            self.send_messages(sender=sender, room_channel=room_channel, messages=messages)
+
+    @precondition(lambda self: 'grow_owners' in self.enabled)
+    @rule(room_channel=ChatValidator.room_channels, count=st.integers(min_value=1, max_value=5))
+    def grow_owners(self, room_channel, count):
+        """Promotes up to `count` members of the room to owners."""
+        room = self.growable_room(room_channel)
+        promotees = [member for member in room.members if member not in room.owners][:count]
+        assume(promotees)
+        promoter = room.owners[0]
+        for promotee in promotees:
+            self.promote_to_owner(promoter=promoter, room_channel=room_channel, promotee=promotee)
+
+    @precondition(lambda self: 'grow_rooms' in self.enabled)
+    @rule(target=ChatValidator.room_channels,
+          creator=ChatValidator.key_aliases,
+          count=st.integers(min_value=1, max_value=10))
+    def grow_rooms(self, creator, count):
+        """Creates `count` rooms owned by `creator`."""
+        return multiple(*[self.create_room(creator=creator, room_name=f'room {i}') for i in range(count)])
+
+    @precondition(lambda self: 'churn_room' in self.enabled)
+    @rule(room_channel=ChatValidator.room_channels)
+    def churn_room(self, room_channel):
+        """Deletes and restores the room, checking the owner's deleted and active rooms in between."""
+        room = self.growable_room(room_channel)
+        owner = room.owners[0]
+        self.delete_room(deleter=owner, room_channel=room_channel)
+        self.get_deleted_rooms(getter=owner)
+        self.restore_room(restorer=owner, room_channel=room_channel)
+        self.get_rooms(getter=owner)
+
+    def teardown(self):
+        # the model is shared by every run, so only the rooms of the aliases registered in this run are measured
+        sizes = measure(self.model, self.run_key_aliases)
+        COVERAGE.record(sizes)
+        self.note(f"state sizes: {sizes}")
+        if not self.is_regression_test:
+            for name, goal in self.goals.items():
+                # capped, so that overshooting one goal doesn't outweigh the others
+                target(min(sizes[name], goal) / goal, label=name)
+        super(ScaleChatValidator, self).teardown()
@@ -0,0 +1,68 @@
+"""
+Tests for the result comparator used by the Chat validator.
+"""
+
+from utils.chat_10_1_0_0_test_utils import assert_results_equal, find_sequence_gaps, first_divergence
+
+
+def _messages(count):
+    return [{
+        'body': f"message {i}", 'sender': 'KA-1', 'message_id': f"MID-{i}", 'timestamp': i, 'seq': i + 1
+    } for i in range(count)]
+
+
+class TestFirstDivergence():
+    def test_ignores_ids_and_timestamps(self):
+        expected = _messages(3)
+        actual = [dict(message, message_id=None, timestamp='') for message in expected]
+        assert first_divergence(expected, actual) is None
+
+    def test_does_not_mutate(self):
+        expected = _messages(3)
+        actual = _messages(3)
+        first_divergence(expected, actual)
+        assert expected == _messages(3)
+        assert actual == _messages(3)
+
+    def test_reports_first_divergent_index_and_field(self):
+        expected = _messages(2500)
+        actual = _messages(2500)
+        actual[1700]['body'] = 'other'
+        actual[2000]['sender'] = 'KA-2'
+        divergence = first_divergence(expected, actual)
+        assert divergence.index == 1700
+        assert divergence.path == ('body', )
+        assert divergence.expected == 'message 1700'
+        assert divergence.actual == 'other'
+
+    def test_reports_length_mismatch(self):
+        divergence = first_divergence(_messages(3), _messages(2))
+        assert divergence.index == 2
+        assert 'got <missing>' in str(divergence)
+
+    def test_reports_nested_room_fields(self):
+        expected = [{'room': {'name': 'room', 'members': ['KA-1', 'KA-2']}, 'message_count': 1, 'last_activity': 1}]
+        actual = [{'room': {'name': 'room', 'members': ['KA-1']}, 'message_count': 1, 'last_activity': 2}]
+        divergence = first_divergence(expected, actual)
+        assert divergence.index == 0
+        assert divergence.path == ('room', 'members', 1)
+
+    def test_custom_ignored_fields(self):
+        assert first_divergence({'channel': 'RID-1', 'name': 'a'}, {'channel': 'RID-2', 'name': 'a'},
+                                ignored_fields={'channel'}) is None
+
+    def test_compares_errors(self):
+        assert_results_equal("ChatError: no", "ChatError: no")
+        assert first_divergence("ChatError: no", []).index is None
+
+
+class TestFindSequenceGaps():
+    def test_no_gaps(self):
+        assert find_sequence_gaps(_messages(5)) == []
+
+    def test_gaps(self):
+        messages = [message for message in _messages(10) if message['seq'] not in (3, 4, 8)]
+        assert find_sequence_gaps(messages) == [3, 4, 8]
+
+    def test_after_seq(self):
+        assert find_sequence_gaps(_messages(10)[5:], after_seq=3) == [4, 5]
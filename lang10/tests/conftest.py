@@ -2,6 +2,8 @@ import pytest
 
 from assembly_client.api.contracts import ContractRef
 
+from utils.chat_10_1_0_0_cache import CachingChatClient
+
 
 @pytest.fixture(scope="function")
 def chat_10(network, store):
@@ -12,3 +14,16 @@ def chat_10(network, store):
         store[alias] = network.register_key_alias()
 
     return lambda sender: network[store[sender]].chat["10-1.0.0"]  # return closure over sender
+
+
+@pytest.fixture(scope="function")
+def cached_chat_10(network, store, chat_10):
+    """Like `chat_10`, but reads go through a validating `CachingChatClient`, one per sender."""
+    clients = {}
+
+    def chat(sender):
+        if sender not in clients:
+            clients[sender] = CachingChatClient(network[store[sender]], validate=True)
+        return clients[sender]
+
+    return chat
@@ -1,17 +1,57 @@
 from hashlib import new
 from assembly_client.api.types.error_types import ContractError
 
+# room digests are polynomial hashes modulo the Mersenne prime 2 ** 61 - 1, matching the contract
+DIGEST_BASE = 257
+DIGEST_MODULUS = 2**61 - 1
+
+# archived messages are stored in pages of this many messages
+ARCHIVE_PAGE_SIZE = 100
+
+
+def digest_fold(digest, value):
+    for c in value:
+        digest = (digest * DIGEST_BASE + ord(c) + 1) % DIGEST_MODULUS
+    return (digest * DIGEST_BASE) % DIGEST_MODULUS
+
+
+# the encodings a message body can be stored in
+MESSAGE_ENCODINGS = ['', 'zlib+base64']
+
+# the most messages send_messages accepts at once
+MAX_SEND_BATCH = 50
+
+
+def tokenize(text):
+    """Splits text into the words indexed by search_messages, the same way as the contract's `_tokenize`."""
+    tokens = []
+    token = ''
+    for c in text:
+        if 'A' <= c <= 'Z':
+            token += c.lower()
+        elif 'a' <= c <= 'z' or '0' <= c <= '9' or ord(c) > 127:
+            token += c
+        elif token:
+            tokens.append(token)
+            token = ''
+    if token:
+        tokens.append(token)
+    return tokens
+
 
 class Message:
-    def __init__(self, sender, body, message_id, message_timestamp):
+    def __init__(self, sender, body, message_id, message_timestamp, seq, encoding):
         self.sender = sender
         self.body = body
         self.message_id = message_id
         self.message_timestamp = message_timestamp
+        self.seq = seq
+        self.encoding = encoding
 
     def as_data(self):
         return {
-            'body': self.body, 'sender': self.sender, 'message_id': self.message_id, 'timestamp': self.message_timestamp
+            'body': self.body, 'sender': self.sender, 'message_id': self.message_id, 'timestamp': self.message_timestamp,
+            'seq': self.seq, 'encoding': self.encoding
         }
 
 
@@ -24,22 +64,103 @@ class Room:
         self.members = [creator]
         self.owners = [creator]
         self.is_deleted = False
+        self.restore_count = 0
         self.channel = channel
-
-    def add_message(self, body, sender, message_id, message_timestamp):
-        self.messages.append(Message(sender, body, message_id, message_timestamp))
+        self.message_count = 0
+        self.last_message_id = None
+        self.last_activity = None
+        self.history_digest = 0
+        self.retention_max_messages = 0
+        self.archived_count = 0  # the first `archived_count` messages are archived
+        self.version = 0
+        self.deltas = []  # the MembershipDeltaEvent of each version
+        self.token_index = {}  # token -> the sequence numbers of the plain text messages containing it
+        self.evicted = False
+        self.digest = None  # the room digest, kept once the rest of the room has been evicted
+
+    def add_message(self, body, sender, message_id, message_timestamp, encoding=''):
+        self.message_count += 1
+        self.messages.append(Message(sender, body, message_id, message_timestamp, self.message_count, encoding))
+        self.last_message_id = message_id
+        self.last_activity = message_timestamp
+        self.history_digest = digest_fold(digest_fold(digest_fold(self.history_digest, sender), body), encoding)
+        if encoding == '':
+            for token in dict.fromkeys(tokenize(body)):
+                self.token_index.setdefault(token, []).append(self.message_count)
+
+    def membership_digest(self):
+        digest = 0
+        for member in self.members:
+            digest = digest_fold(digest, member)
+        digest = digest_fold(digest, '')
+        for owner in self.owners:
+            digest = digest_fold(digest, owner)
+        return digest
+
+    def digest_as_data(self):
+        return {
+            'message_count': self.message_count, 'history_digest': self.history_digest,
+            'membership_digest': self.membership_digest()
+        }
 
     def get_messages(self):
-        return [message.as_data() for message in self.messages]
+        return [message.as_data() for message in self.messages[self.archived_count:]]
+
+    def get_messages_after(self, after_seq, limit):
+        # sequence numbers start at 1 and have no gaps, so they index the message list directly
+        start = max(after_seq, self.archived_count)
+        return [message.as_data() for message in self.messages[start:start + limit]]
+
+    def search_messages(self, query, limit):
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        matches = set(self.token_index.get(tokens[0], ()))
+        for token in tokens[1:]:
+            matches &= set(self.token_index.get(token, ()))
+        hot = sorted(seq for seq in matches if seq > self.archived_count)
+        return [self.messages[seq - 1].as_data() for seq in hot[:limit]]
+
+    def archive_history(self):
+        self.archived_count = self.message_count - self.retention_max_messages
+
+    def get_archived_messages(self, page):
+        start = page * ARCHIVE_PAGE_SIZE
+        end = min(start + ARCHIVE_PAGE_SIZE, self.archived_count)
+        return [message.as_data() for message in self.messages[start:end]]
+
+    def record_membership_change(self, action, actor, member):
+        self.version += 1
+        self.deltas.append(MembershipDeltaEvent(self, action, actor, member))
+
+    def evict(self):
+        # keeps the counts and digests, everything that grows with the room's history is dropped
+        self.digest = self.digest_as_data()
+        self.messages = None
+        self.token_index = None
+        self.members = None
+        self.owners = None
+        self.deltas = None
+        self.evicted = True
 
     def delete(self):
         self.is_deleted = True
 
     def restore(self):
         self.is_deleted = False
+        self.restore_count += 1
 
-    def as_data(self):
-        return {'name': self.name, 'is_deleted': self.is_deleted, 'members': self.members, 'owners': self.owners, 'channel': self.channel}
+    def as_data(self, summary=False):
+        room = {
+            'name': self.name, 'is_deleted': self.is_deleted, 'members': self.members, 'owners': self.owners,
+            'channel': self.channel, 'version': self.version
+        }
+        if summary:
+            return {
+                'room': room, 'message_count': self.message_count, 'last_message_id': self.last_message_id,
+                'last_activity': self.last_activity
+            }
+        return room
 
 
 class CreateRoomEvent:
@@ -86,6 +207,21 @@ class RemoveFromRoomEvent:
         return {'room': self.room.as_data(), 'remover': self.remover, 'removee': self.removee}
 
 
+class MembershipDeltaEvent:
+    def __init__(self, room, action, actor, member):
+        self.room_channel = room.channel
+        self.room_version = room.version
+        self.action = action
+        self.actor = actor
+        self.member = member
+
+    def as_data(self):
+        return {
+            'room_channel': self.room_channel, 'room_version': self.room_version, 'action': self.action,
+            'actor': self.actor, 'member': self.member
+        }
+
+
 class SendMessageEvent:
     def __init__(self, room, message_id):
         self.room = room
@@ -94,6 +230,24 @@ class SendMessageEvent:
     def as_data(self):
         return {'room': self.room.as_data(), 'message_id': self.message_id}
 
+class SetRoomRetentionEvent:
+    def __init__(self, room, max_messages):
+        self.room = room
+        self.max_messages = max_messages
+
+    def as_data(self):
+        return {'room': self.room.as_data(), 'max_messages': self.max_messages}
+
+
+class ArchiveRoomHistoryEvent:
+    def __init__(self, room, archived_count):
+        self.room = room
+        self.archived_count = archived_count
+
+    def as_data(self):
+        return {'room': self.room.as_data(), 'archived_count': self.archived_count}
+
+
 class PromoteToOwnerEvent:
     def __init__(self, room, promoter, promotee):
         self.room = room
@@ -115,6 +269,34 @@ class DemoteOwnerEvent:
 class ChatModel:
     def __init__(self):
         self.rooms = {}
+        # the channels of the rooms each member can see, so that get_rooms never visits deleted rooms
+        self.active_rooms = {}
+        # the channels of deleted rooms, the only ones get_deleted_rooms visits
+        self.deleted_rooms = set()
+
+    def _index_room(self, member, room_channel):
+        self.active_rooms.setdefault(member, set()).add(room_channel)
+
+    def _unindex_room(self, member, room_channel):
+        self.active_rooms.get(member, set()).discard(room_channel)
+
+    def evict_rooms(self, members):
+        """Evicts every room that one of `members` belongs to, and drops the room indexes of `members`.
+
+        Only safe once nothing can call the model as one of `members` again.
+        """
+        members = set(members)
+        room_channels = set()
+        for member in members:
+            room_channels |= self.active_rooms.pop(member, set())
+        # deleted rooms aren't in `active_rooms`
+        room_channels |= {
+            room_channel for room_channel in self.deleted_rooms if members.intersection(self.rooms[room_channel].members)
+        }
+        for room_channel in room_channels:
+            self.rooms[room_channel].evict()
+            self.deleted_rooms.discard(room_channel)
+        return len(room_channels)
 
     def _get_room(self, getter, room_channel):
         def room_not_found():
@@ -123,6 +305,8 @@ class ChatModel:
         if room_channel not in self.rooms:
             room_not_found()  # doesn't exist
         room = self.rooms[room_channel]
+        if room.evicted:
+            raise AssertionError(f"Room {room_channel} has been evicted from the model and can no longer be used.")
         if getter not in room.members:
             room_not_found()  # not visible, wrong channel
         return room
@@ -134,6 +318,7 @@ class ChatModel:
             raise ContractError("Room name cannot contain null byte.")
         room = Room(room_channel, room_name, creator, room_channel)
         self.rooms[room_channel] = room
+        self._index_room(creator, room_channel)
         return CreateRoomEvent(room).as_data()
 
     def invite_to_room(self, inviter, room_channel, new_member):
@@ -146,6 +331,8 @@ class ChatModel:
             raise ContractError(f"{room.channel} is deleted.")
 
         room.members.append(new_member)
+        self._index_room(new_member, room_channel)
+        room.record_membership_change('invite', inviter, new_member)
         return InviteToRoomEvent(room, inviter=inviter, invitee=new_member).as_data()
 
     def remove_from_room(self, remover, room_channel, member_to_remove):
@@ -158,9 +345,13 @@ class ChatModel:
             raise ContractError(f"Room {room.channel} is deleted! Operation Denied.")
         if member_to_remove == remover:
             raise ContractError("Cannot remove self from room.")
-        room.members.remove(member_to_remove)
+        # owners are demoted first, in a transaction of their own
         if member_to_remove in room.owners:
             room.owners.remove(member_to_remove)
+            room.record_membership_change('demote', remover, member_to_remove)
+        room.members.remove(member_to_remove)
+        self._unindex_room(member_to_remove, room_channel)
+        room.record_membership_change('remove', remover, member_to_remove)
         return RemoveFromRoomEvent(room, remover=remover, removee=member_to_remove).as_data()
 
     def delete_room(self, deleter, room_channel):
@@ -172,6 +363,9 @@ class ChatModel:
         if deleter not in room.owners:
             raise ContractError(f"{deleter} is not an owner and does not have permission to delete the room.")
         room.delete()
+        for member in room.members:
+            self._unindex_room(member, room_channel)
+        self.deleted_rooms.add(room_channel)
         return DeleteRoomEvent(room).as_data()
 
     def restore_room(self, restorer, room_channel):
@@ -184,9 +378,30 @@ class ChatModel:
         if restorer not in room.owners:
             raise ContractError(f"{restorer} is not an owner and does not have permission to restore the room.")
         room.restore()
+        for member in room.members:
+            self._index_room(member, room_channel)
+        self.deleted_rooms.discard(room_channel)
         return RestoreRoomEvent(room).as_data()
 
-    def send_message(self, sender, room_channel, message, message_id, message_timestamp):
+    def send_message(self, sender, room_channel, message, message_id, message_timestamp, encoding=''):
+        room = self._send_message_checks(sender, room_channel, message, encoding)
+        room.add_message(message, sender, message_id, message_timestamp, encoding)
+        return SendMessageEvent(room, message_id)
+
+    def send_messages(self, sender, room_channel, messages, message_ids=None, message_timestamp=None):
+        if not messages:
+            raise ContractError("Messages cannot be empty.")
+        if len(messages) > MAX_SEND_BATCH:
+            raise ContractError(f"Cannot send more than {MAX_SEND_BATCH} messages at once.")
+        # the messages are sent in one transaction, so either all of them are stored or none
+        for message in messages:
+            room = self._send_message_checks(sender, room_channel, message, '')
+        message_ids = message_ids or [None] * len(messages)
+        for message, message_id in zip(messages, message_ids):
+            room.add_message(message, sender, message_id, message_timestamp)
+        return [SendMessageEvent(room, message_id).as_data() for message_id in message_ids]
+
+    def _send_message_checks(self, sender, room_channel, message, encoding):
         room = self._get_room(sender, room_channel)
         if room.is_deleted:
             raise ContractError("Room {} has been deleted. Cannot send message.".format(room_channel))
@@ -194,8 +409,11 @@ class ChatModel:
             raise ContractError("Message cannot be empty.")
         if chr(0) in message:
             raise ContractError("Message cannot contain null byte.")
-        room.add_message(message, sender, message_id, message_timestamp)
-        return SendMessageEvent(room, message_id)
+        if len(message) > 4000:
+            raise ContractError("Message cannot be longer than 4000 characters.")
+        if encoding not in MESSAGE_ENCODINGS:
+            raise ContractError(f"Unknown message encoding {encoding}.")
+        return room
 
     def get_messages(self, getter, room_channel):
         room = self._get_room(getter, room_channel)
@@ -203,8 +421,83 @@ class ChatModel:
             raise ContractError("Room {} has been deleted. Cannot get messages.".format(room_channel))
         return room.get_messages()
 
+    def get_message(self, getter, room_channel, message_id):
+        self.get_messages(getter, room_channel)  # same visibility rules
+        for message in self._get_room(getter, room_channel).messages:
+            if message.message_id == message_id:
+                return message.as_data()
+        raise ContractError(f"Message {message_id} not found.")
+
+    def get_messages_after(self, getter, room_channel, after_seq, limit):
+        if limit < 1:
+            raise ContractError("Limit must be at least 1.")
+        self.get_messages(getter, room_channel)  # same visibility rules
+        return self._get_room(getter, room_channel).get_messages_after(after_seq, limit)
+
+    def search_messages(self, getter, room_channel, query, limit):
+        room = self._get_room(getter, room_channel)
+        if room.is_deleted:
+            raise ContractError("Room {} has been deleted. Cannot get messages.".format(room_channel))
+        if query == '':
+            raise ContractError("Query cannot be empty.")
+        if chr(0) in query:
+            raise ContractError("Query cannot contain null byte.")
+        if len(query) > 4000:
+            raise ContractError("Query cannot be longer than 4000 characters.")
+        if limit < 1:
+            raise ContractError("Limit must be at least 1.")
+        return room.search_messages(query, limit)
+
+    def _retention_checks(self, caller, room, action):
+        if caller not in room.owners:
+            raise ContractError(f'{caller} is not an owner of the room. Operation denied.')
+        if room.is_deleted:
+            raise ContractError(f'Room {room.channel} has been deleted. Cannot {action}.')
+
+    def set_room_retention(self, caller, room_channel, max_messages):
+        room = self._get_room(caller, room_channel)
+        self._retention_checks(caller, room, 'change retention')
+        if max_messages < 0:
+            raise ContractError("Retention cannot be negative.")
+        room.retention_max_messages = max_messages
+        return SetRoomRetentionEvent(room, max_messages).as_data()
+
+    def archive_room_history(self, caller, room_channel):
+        room = self._get_room(caller, room_channel)
+        self._retention_checks(caller, room, 'archive')
+        if room.retention_max_messages == 0:
+            raise ContractError(f'Room {room_channel} has no retention limit.')
+        if room.message_count - room.retention_max_messages <= room.archived_count:
+            raise ContractError(f'Room {room_channel} has nothing to archive.')
+        room.archive_history()
+        return ArchiveRoomHistoryEvent(room, room.archived_count).as_data()
+
+    def get_archived_messages(self, getter, room_channel, page):
+        self.get_messages(getter, room_channel)  # same visibility rules
+        if page < 0:
+            raise ContractError("Page cannot be negative.")
+        return self._get_room(getter, room_channel).get_archived_messages(page)
+
+    def get_room_digest(self, getter, room_channel):
+        room = self._get_room(getter, room_channel)
+        if room.is_deleted:
+            raise ContractError("Room {} has been deleted. Cannot get messages.".format(room_channel))
+        return room.digest_as_data()
+
     def get_rooms(self, getter):
-        rooms = [room.as_data() for room in self.rooms.values() if getter in room.members and not room.is_deleted]
+        rooms = [self.rooms[room_channel].as_data() for room_channel in self.active_rooms.get(getter, ())]
+        return sorted(rooms, key=lambda room: (room['name'], room['channel']))
+
+    def get_room(self, getter, room_channel):
+        return self._get_room(getter, room_channel).as_data()
+
+    def get_room_summaries(self, getter):
+        rooms = [self.rooms[room_channel] for room_channel in self.active_rooms.get(getter, ())]
+        return [room.as_data(summary=True) for room in sorted(rooms, key=lambda room: (room.name, room.channel))]
+
+    def get_deleted_rooms(self, getter):
+        rooms = [self.rooms[room_channel] for room_channel in self.deleted_rooms]
+        rooms = [room.as_data() for room in rooms if getter in room.owners]
         return sorted(rooms, key=lambda room: (room['name'], room['channel']))
 
     def promote_to_owner(self, promoter, room_channel, member):
@@ -219,6 +512,7 @@ class ChatModel:
             raise ContractError(f'{promoter} is not an owner of the room. Operation denied.')
 
         room.owners.append(member)
+        room.record_membership_change('promote', promoter, member)
         return PromoteToOwnerEvent(room=room, promoter=promoter, promotee=member).as_data()
 
     def demote_owner(self, demoter, room_channel, owner):
@@ -238,5 +532,6 @@ class ChatModel:
             raise ContractError(f"Cannot demote yourself!")
     
         room.owners.remove(owner)
-        
+        room.record_membership_change('demote', demoter, owner)
+
         return DemoteOwnerEvent(room=room, demoter=demoter, demotee=owner).as_data()
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""
+Event-driven read-through cache for the Chat client
+"""
+
+from copy import deepcopy
+
+from utils.chat_10_1_0_0_events import CHAT_VERSION, EventSubscription
+from utils.chat_10_1_0_0_test_utils import assert_results_equal
+
+# read-only contract functions whose results are cached
+CACHED_READS = frozenset([
+    'get_rooms', 'get_room', 'get_deleted_rooms', 'get_room_summaries', 'get_messages', 'get_message',
+    'get_messages_after', 'get_archived_messages', 'get_room_digest', 'search_messages'
+])
+
+
+def _event_room_channel(event):
+    # membership deltas name the channel instead of carrying the whole room
+    if 'room_channel' in event['data']:
+        return event['data']['room_channel']
+    return event['data'].get('room', {}).get('channel')
+
+
+class CachingChatClient:
+    """Wraps `network[alias].chat[version]` and memoizes its read calls.
+
+    Reads are cached per function and arguments, so per room for room-scoped reads. Before each read, the alias's new
+    events are polled, from the subscription's cursor so that a hit reads only the events since the last read, and every
+    chat event invalidates the cached reads of its room and the alias-wide room lists.
+    Writes made through the wrapper invalidate eagerly, without waiting for their events. Errors are never cached.
+
+    With `validate=True` every hit is also read from the node and compared to the cached result, which proves the
+    invalidation rules correct at the cost of the round trip the cache would otherwise save.
+    """
+
+    def __init__(self, node, version=CHAT_VERSION, validate=False):
+        self.chat = node.chat[version]
+        self.events = EventSubscription(node, version=version)
+        self.validate = validate
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def invalidate(self, room_channel=None):
+        """Drops the alias-wide reads, and the reads of `room_channel` if given."""
+        stale = [key for key in self.cache if key[1] is None or key[1] == room_channel]
+        for key in stale:
+            del self.cache[key]
+        self.invalidations += len(stale)
+
+    def _sync(self):
+        for event in self.events.poll():
+            self.invalidate(_event_room_channel(event))
+
+    def _read(self, method, **kwargs):
+        self._sync()
+        key = (method, kwargs.get('room_channel'), tuple(sorted(kwargs.items())))
+        if key in self.cache:
+            self.hits += 1
+            if self.validate:
+                assert_results_equal(self.cache[key], getattr(self.chat, method)(**kwargs), ignored_fields=())
+        else:
+            self.misses += 1
+            self.cache[key] = getattr(self.chat, method)(**kwargs)
+        # callers are free to scrub their results, so never hand out the cached object itself
+        return deepcopy(self.cache[key])
+
+    def _write(self, method, **kwargs):
+        try:
+            return getattr(self.chat, method)(**kwargs)
+        finally:
+            self.invalidate(kwargs.get('room_channel'))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations}
+
+    def __getattr__(self, method):
+        if method in CACHED_READS:
+            return lambda **kwargs: self._read(method, **kwargs)
+        return lambda **kwargs: self._write(method, **kwargs)
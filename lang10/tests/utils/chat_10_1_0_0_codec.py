@@ -0,0 +1,91 @@
+"""
+Compressed message bodies for Chat
+"""
+
+import base64
+import zlib
+
+# the contract's limit on message bodies, in characters
+MESSAGE_LENGTH = 4000
+
+PLAIN = ''
+ZLIB_BASE64 = 'zlib+base64'
+
+
+class BodyCodec:
+    """Compresses message bodies above a size threshold, and decodes them again.
+
+    Bodies are only stored compressed when that makes them shorter. The counters record how many bytes the encoded
+    bodies take compared to their text, both for stored messages and for the messages read back.
+    """
+
+    def __init__(self, threshold=1024, level=9):
+        self.threshold = threshold
+        self.level = level
+        self.messages_encoded = 0
+        self.messages_compressed = 0
+        self.text_bytes = 0
+        self.stored_bytes = 0
+        self.messages_read = 0
+        self.wire_bytes = 0
+        self.read_text_bytes = 0
+
+    def encode(self, body):
+        """Returns the `(body, encoding)` to send for the text `body`."""
+        if len(body) > MESSAGE_LENGTH:
+            # once compressed, the contract cannot check the length of the text any more
+            raise ValueError(f"Message cannot be longer than {MESSAGE_LENGTH} characters.")
+        text = body.encode('utf-8')
+        encoded, encoding = body, PLAIN
+        if len(text) >= self.threshold:
+            compressed = base64.b64encode(zlib.compress(text, self.level)).decode('ascii')
+            if len(compressed) < len(body):
+                encoded, encoding = compressed, ZLIB_BASE64
+        self.messages_encoded += 1
+        self.messages_compressed += encoding == ZLIB_BASE64
+        self.text_bytes += len(text)
+        self.stored_bytes += len(encoded.encode('utf-8'))
+        return encoded, encoding
+
+    def decode(self, message):
+        """Returns a copy of the `message` result with its body decoded to text."""
+        body = message['body']
+        if message.get('encoding', PLAIN) == ZLIB_BASE64:
+            body = zlib.decompress(base64.b64decode(message['body'])).decode('utf-8')
+        self.messages_read += 1
+        self.wire_bytes += len(message['body'].encode('utf-8'))
+        self.read_text_bytes += len(body.encode('utf-8'))
+        return dict(message, body=body, encoding=PLAIN)
+
+    def stats(self):
+        return {
+            'messages_encoded': self.messages_encoded,
+            'messages_compressed': self.messages_compressed,
+            'text_bytes': self.text_bytes,
+            'stored_bytes': self.stored_bytes,
+            'messages_read': self.messages_read,
+            'wire_bytes': self.wire_bytes,
+            'read_text_bytes': self.read_text_bytes,
+        }
+
+
+class CompressingChatClient:
+    """Wraps `network[alias].chat[version]` so that large bodies are sent compressed and every message read is
+    decoded. All other calls pass through unchanged."""
+
+    MESSAGE_READS = frozenset(['get_messages', 'get_messages_after', 'get_archived_messages'])
+
+    def __init__(self, chat, codec=None):
+        self.chat = chat
+        self.codec = BodyCodec() if codec is None else codec
+
+    def send_message(self, room_channel, message):
+        body, encoding = self.codec.encode(message)
+        if encoding == PLAIN:
+            return self.chat.send_message(room_channel=room_channel, message=body)
+        return self.chat.send_encoded_message(room_channel=room_channel, message=body, encoding=encoding)
+
+    def __getattr__(self, method):
+        if method in self.MESSAGE_READS:
+            return lambda **kwargs: [self.codec.decode(message) for message in getattr(self.chat, method)(**kwargs)]
+        return getattr(self.chat, method)
@@ -0,0 +1,63 @@
+"""
+Incremental event subscriptions for Chat
+"""
+
+import time
+
+CHAT_VERSION = "10-1.0.0"
+
+
+class EventSubscription:
+    """Reads the events of one key alias incrementally.
+
+    The subscription keeps a cursor (`since`) into the alias's event log and asks the node only for the events after
+    it, so a poll costs as much as the events that arrived since the last one, however long the log is. `node` is
+    `network[key_alias]`. A subscription created with `since=None` starts at the end of the current log, which is the
+    only time the whole log is read.
+    """
+
+    def __init__(self, node, since=None, event_types=None, room_channel=None, version=CHAT_VERSION):
+        self.node = node
+        self.prefix = f"chat/{version}/"
+        self.event_types = None if event_types is None else {self.prefix + t for t in event_types}
+        self.room_channel = room_channel
+        self.since = len(node.events()) if since is None else since
+
+    def _matches(self, event):
+        if not event['type'].startswith(self.prefix):
+            return False
+        if self.event_types is not None and event['type'] not in self.event_types:
+            return False
+        if self.room_channel is not None and self.room_channel not in (event['data'].get('room_channel'),
+                                                                       event['data'].get('room', {}).get('channel')):
+            return False
+        return True
+
+    def _fetch(self):
+        return self.node.events(since=self.since)
+
+    def poll(self):
+        """Returns the matching events since the cursor, and advances the cursor past every new event."""
+        new_events = self._fetch()
+        self.since += len(new_events)
+        return [event for event in new_events if self._matches(event)]
+
+    def wait_for(self, event_type=None, predicate=None, timeout=10.0, interval=0.1):
+        """Blocks until a new matching event arrives, and returns it. The cursor is left just past that event, so
+        later events are seen by the next call. Raises `TimeoutError` if nothing matches within `timeout` seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            new_events = self._fetch()
+            for i, event in enumerate(new_events):
+                if not self._matches(event):
+                    continue
+                if event_type is not None and event['type'] != self.prefix + event_type:
+                    continue
+                if predicate is not None and not predicate(event):
+                    continue
+                self.since += i + 1
+                return event
+            self.since += len(new_events)
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f"No matching event within {timeout}s.")
+            time.sleep(interval)
@@ -0,0 +1,112 @@
+"""
+Resumable streaming export of Chat room histories
+"""
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import msgpack
+
+# the contract's archive page size, page p holds the messages numbered p * ARCHIVE_PAGE_SIZE + 1 onwards
+ARCHIVE_PAGE_SIZE = 100
+
+NDJSON = 'ndjson'
+MSGPACK = 'msgpack'
+FORMATS = (NDJSON, MSGPACK)
+
+
+def _resume_ndjson(path):
+    """Returns the sequence number of the last complete line of `path`, dropping a partially written last line."""
+    with open(path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        # walk back from the end in blocks until the start of the last complete line is found
+        position, tail = end, b''
+        while position > 0 and tail.count(b'\n') < 2:
+            step = min(4096, position)
+            position -= step
+            f.seek(position)
+            tail = f.read(step) + tail
+        complete = tail.rfind(b'\n') + 1
+        f.truncate(position + complete)
+        lines = tail[:complete].splitlines()
+        return json.loads(lines[-1])['seq'] if lines else 0
+
+
+def _resume_msgpack(path):
+    """Returns the sequence number of the last complete message in `path`, dropping a partially written last one."""
+    last_seq = 0
+    with open(path, 'rb+') as f:
+        unpacker = msgpack.Unpacker(f, raw=False)
+        complete = 0
+        for message in unpacker:
+            last_seq = message['seq']
+            complete = unpacker.tell()
+        f.truncate(complete)
+    return last_seq
+
+
+class RoomExporter:
+    """Streams the history of a room to a file, one message per record, in sequence order.
+
+    Messages are read `page_size` at a time by sequence number, with `get_messages_after` for the messages still in the
+    room and `get_archived_messages` for the archived ones, so memory use doesn't grow with the room. Each page is
+    flushed before the next one is read. An interrupted export resumes after the last complete record of the file.
+
+    With a `codec`, compressed bodies are decoded to text before they are written.
+    """
+
+    def __init__(self, chat, page_size=500, codec=None):
+        self.chat = chat
+        self.page_size = page_size
+        self.codec = codec
+
+    def pages(self, room_channel, after_seq=0):
+        """Yields the messages of the room numbered after `after_seq`, one page at a time."""
+        while True:
+            page = self.chat.get_messages_after(room_channel=room_channel, after_seq=after_seq, limit=self.page_size)
+            if page and page[0]['seq'] > after_seq + 1:
+                # the messages in between have been archived
+                archived = self.chat.get_archived_messages(room_channel=room_channel,
+                                                           page=after_seq // ARCHIVE_PAGE_SIZE)
+                page = [message for message in archived if message['seq'] > after_seq]
+            if not page:
+                return
+            yield page
+            after_seq = page[-1]['seq']
+
+    def export_room(self, room_channel, path, fmt=NDJSON):
+        """Exports the room to `path`, continuing the file if it exists. Returns the number of messages written."""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown export format {fmt}.")
+        after_seq = 0
+        if os.path.exists(path):
+            after_seq = _resume_ndjson(path) if fmt == NDJSON else _resume_msgpack(path)
+
+        written = 0
+        with open(path, 'ab') as f:
+            for page in self.pages(room_channel, after_seq):
+                for message in page:
+                    if self.codec is not None:
+                        message = self.codec.decode(message)
+                    if fmt == NDJSON:
+                        f.write(json.dumps(message, sort_keys=True).encode('utf-8') + b'\n')
+                    else:
+                        f.write(msgpack.packb(message, use_bin_type=True))
+                f.flush()
+                written += len(page)
+        return written
+
+
+def export_rooms(chat, room_channels, directory, fmt=NDJSON, max_workers=4, **kwargs):
+    """Exports each room to `<directory>/<room_channel>.<fmt>`, at most `max_workers` rooms at a time.
+
+    Returns the number of messages written for each room. Extra keyword arguments are passed to `RoomExporter`.
+    """
+    exporter = RoomExporter(chat, **kwargs)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for room_channel in room_channels:
+            path = os.path.join(directory, f'{room_channel}.{fmt}')
+            futures[room_channel] = pool.submit(exporter.export_room, room_channel, path, fmt)
+        return {room_channel: future.result() for room_channel, future in futures.items()}
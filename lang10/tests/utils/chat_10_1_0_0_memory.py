@@ -0,0 +1,102 @@
+"""
+Memory footprint of the Chat model over long runs
+"""
+
+import sys
+import tracemalloc
+
+# the structures of a `ChatModel` whose sizes are reported, in the order their shared objects are attributed
+STRUCTURES = ('messages', 'members', 'index', 'rooms')
+
+
+def _deep_size(obj, seen):
+    """The size of `obj` and everything it refers to, except the objects in `seen`, which it adds to."""
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+    return size
+
+
+def structure_sizes(model):
+    """The bytes held by each of `STRUCTURES` of the model.
+
+    Objects shared between structures, like the key aliases in both messages and member lists, are counted once, in
+    the first structure of `STRUCTURES` that refers to them. `rooms` is what's left: the rooms and their scalar fields.
+    """
+    seen = set()
+    rooms = model.rooms.values()
+    sizes = {
+        'messages': sum(_deep_size(room.messages, seen) for room in rooms),
+        'members': sum(_deep_size([room.members, room.owners, room.deltas], seen)
+                       for room in rooms) + _deep_size(model.active_rooms, seen),
+        'index': sum(_deep_size(room.token_index, seen) for room in rooms) + _deep_size(model.deleted_rooms, seen),
+    }
+    sizes['rooms'] = _deep_size(model.rooms, seen)
+    return sizes
+
+
+class MemoryTracker:
+    """Samples the size of a model's structures and the memory traced by `tracemalloc`, for example once per run.
+
+    Tracing is started by the tracker if it isn't already on, and should be stopped with `stop` when the run ends, so
+    that it doesn't slow down the code after it; `start` resumes it for the next run. The allocations present when the
+    tracker first starts are the baseline the report's top allocation sites are compared to.
+    """
+
+    def __init__(self, frames=1):
+        self.frames = frames
+        self.started_tracing = False
+        self.baseline = None
+        # the allocations at the last sample, tracing may be off by the time of the report
+        self.snapshot = None
+        self.samples = []
+        self.start()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.started_tracing = True
+        if self.baseline is None:
+            self.baseline = self._snapshot()
+
+    def sample(self, model):
+        current, peak = tracemalloc.get_traced_memory()
+        sample = dict(structure_sizes(model), traced=current, peak=peak, room_count=len(model.rooms))
+        self.samples.append(sample)
+        self.snapshot = self._snapshot()
+        return sample
+
+    def report(self, top=5):
+        """The first and last samples, and the `top` lines that allocated the most between the baseline and the last
+        sample."""
+        lines = [f'memory over {len(self.samples)} samples']
+        if self.samples:
+            first, last = self.samples[0], self.samples[-1]
+            for name in STRUCTURES + ('traced', 'peak', 'room_count'):
+                lines.append(f'  {name}: {first[name]} -> {last[name]}')
+        if self.snapshot is not None:
+            for stat in self.snapshot.compare_to(self.baseline, 'lineno')[:top]:
+                lines.append(f'  {stat}')
+        return '\n'.join(lines)
+
+    def stop(self):
+        """Stops tracing, if the tracker started it."""
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    @staticmethod
+    def _snapshot():
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
@@ -0,0 +1,77 @@
+"""
+Size goals and state-space coverage for scale runs of the Chat model validator
+"""
+
+from collections import Counter
+
+# the sizes production rooms reach, which scale runs of the validator aim for
+SCALE_GOALS = {
+    'members_per_room': 200,
+    'messages_per_room': 2000,
+    'owners_per_room': 10,
+    'rooms_per_alias': 20,
+    'restores_per_room': 5,
+}
+
+# upper bounds of the size regions, each region holds the sizes from the previous bound up to its own
+REGION_BOUNDS = (0, 9, 99, 999)
+
+
+def region_of(size):
+    """Names the region of a size, `0`, `1-9`, `10-99`, `100-999` or `1000+`."""
+    low = 0
+    for bound in REGION_BOUNDS:
+        if size <= bound:
+            return str(bound) if low == bound else f'{low}-{bound}'
+        low = bound + 1
+    return f'{low}+'
+
+
+def measure(model, key_aliases):
+    """The largest size of each goal over the rooms of the model that one of `key_aliases` belongs to.
+
+    The model is shared by every run, so only the rooms reachable from the aliases of the current run are measured.
+    """
+    key_aliases = set(key_aliases)
+    rooms = [room for room in model.rooms.values() if not room.evicted and key_aliases.intersection(room.members)]
+    return {
+        'members_per_room': max((len(room.members) for room in rooms), default=0),
+        'messages_per_room': max((room.message_count for room in rooms), default=0),
+        'owners_per_room': max((len(room.owners) for room in rooms), default=0),
+        'rooms_per_alias': max((len(model.active_rooms.get(alias, ())) for alias in key_aliases), default=0),
+        'restores_per_room': max((room.restore_count for room in rooms), default=0),
+    }
+
+
+class StateCoverage:
+    """Counts the runs that ended in each size region of each goal."""
+
+    def __init__(self, goals=None):
+        self.goals = dict(SCALE_GOALS if goals is None else goals)
+        self.regions = {name: Counter() for name in self.goals}
+        self.largest = {name: 0 for name in self.goals}
+        self.runs = 0
+
+    def record(self, sizes):
+        self.runs += 1
+        for name in self.goals:
+            self.regions[name][region_of(sizes[name])] += 1
+            self.largest[name] = max(self.largest[name], sizes[name])
+
+    def reached(self, name):
+        return self.largest[name] >= self.goals[name]
+
+    def report(self):
+        """One line per goal: the regions reached with their run counts, the largest size and whether the goal was met.
+        """
+        lines = [f'state coverage over {self.runs} runs']
+        for name, goal in self.goals.items():
+            regions = ', '.join(f'{region}: {count}'
+                                for region, count in sorted(self.regions[name].items(), key=_region_order))
+            status = 'reached' if self.reached(name) else 'not reached'
+            lines.append(f'  {name} [{regions}] largest {self.largest[name]}, goal {goal} {status}')
+        return '\n'.join(lines)
+
+
+def _region_order(item):
+    return int(item[0].split('-')[0].rstrip('+'))
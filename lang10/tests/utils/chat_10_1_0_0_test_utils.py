@@ -2,11 +2,80 @@
 Test utilities for Chat
 """
 
+from collections import namedtuple
 
-def scrub_ids_and_timestamps(messages):
+# fields the model cannot know in advance, since the network generates them
+NONDETERMINISTIC_FIELDS = frozenset(['message_id', 'timestamp', 'last_message_id', 'last_activity'])
+
+_MISSING = object()
+
+
+class Divergence(namedtuple('Divergence', ['index', 'path', 'expected', 'actual'])):
+    """The first place where two results differ. `index` is the position in the top-level list (None for a non-list
+    result) and `path` is the sequence of keys and indices leading from that element to the differing value."""
+
+    def __str__(self):
+        location = ''.join(f"[{step!r}]" for step in self.path)
+        expected = '<missing>' if self.expected is _MISSING else repr(self.expected)
+        actual = '<missing>' if self.actual is _MISSING else repr(self.actual)
+        return f"results diverge at index {self.index}{location}: expected {expected}, got {actual}"
+
+
+def _diverge(expected, actual, ignored_fields, path):
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in expected:
+            if key in ignored_fields:
+                continue
+            divergence = _diverge(expected[key], actual.get(key, _MISSING), ignored_fields, path + (key, ))
+            if divergence is not None:
+                return divergence
+        for key in actual:
+            if key not in ignored_fields and key not in expected:
+                return path + (key, ), _MISSING, actual[key]
+        return None
+    if isinstance(expected, list) and isinstance(actual, list):
+        for i, (expected_item, actual_item) in enumerate(zip(expected, actual)):
+            divergence = _diverge(expected_item, actual_item, ignored_fields, path + (i, ))
+            if divergence is not None:
+                return divergence
+        if len(expected) != len(actual):
+            i = min(len(expected), len(actual))
+            return (path + (i, ), expected[i] if i < len(expected) else _MISSING,
+                    actual[i] if i < len(actual) else _MISSING)
+        return None
+    if expected != actual:
+        return path, expected, actual
+    return None
+
+
+def first_divergence(expected, actual, ignored_fields=NONDETERMINISTIC_FIELDS):
+    """Compares two contract results field by field and returns the first `Divergence`, or None if they match.
+
+    Lists are walked in order and the walk stops at the first difference, so matching prefixes of large `get_messages`
+    results are never copied. Keys in `ignored_fields` are skipped at every depth. Neither argument is modified.
+    """
+    divergence = _diverge(expected, actual, ignored_fields, ())
+    if divergence is None:
+        return None
+    path, expected_value, actual_value = divergence
+    if isinstance(expected, list) and isinstance(actual, list):
+        return Divergence(path[0], path[1:], expected_value, actual_value)
+    return Divergence(None, path, expected_value, actual_value)
+
+
+def assert_results_equal(expected, actual, ignored_fields=NONDETERMINISTIC_FIELDS):
+    divergence = first_divergence(expected, actual, ignored_fields)
+    assert divergence is None, str(divergence)
+
+
+def find_sequence_gaps(messages, after_seq=0):
+    """Returns the sequence numbers missing from `messages`, which must be sorted and start after `after_seq`."""
+    gaps = []
+    expected = after_seq + 1
     for message in messages:
-        del message['message_id']
-        del message['timestamp']
+        gaps.extend(range(expected, message['seq']))
+        expected = message['seq'] + 1
+    return gaps
 
 
 def scrub_channels(rooms):